@@ -8,22 +8,45 @@ Simple slideshow maker. The following external tools are needed:
     - mkvtoolnix (mkvmerge)
 """
 
+import hashlib
+import json
+import math
 import multiprocessing as mp
 import os
+import queue
+import re
 import shutil
+import struct
 import subprocess
 import sys
 import time
 
 from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from imghdr import what
 from itertools import cycle, tee
 from random import randint
 from tempfile import gettempdir
-from threading import Thread
+from threading import Lock, Thread
 from xml.sax.saxutils import escape
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+except ImportError:
+    Image = None
+
 
 __version__ = '0.1'
 
@@ -32,6 +55,67 @@ _P = cycle(r'\|/-')
 _exe = '.exe' if os.name == 'nt' else ''
 EXT = ('tiff', 'jpeg', 'bmp', 'png')
 AUDIO_EXT = ('.wav', '.ogg', '.mp3', '.m4a', '.aac')
+# ffmpeg encoder and bitrate for the soundtrack
+AUDIO_CODECS = {
+    'aac': ('aac', '256k'),
+    'opus': ('libopus', '192k'),
+}
+# Formats for the pictures written to the working directory. Everything
+# except jpg is lossless, ppm/pam are uncompressed and the fastest to write
+# and decode, but need the most space.
+INTERMEDIATE_FORMATS = ('jpg', 'png', 'ppm', 'pam', 'bmp', 'tiff', 'qoi')
+# ffmpeg decoder and ImageMagick format needed for each intermediate format
+# (qoi needs ImageMagick >= 7.1 and ffmpeg >= 5.1)
+INTERMEDIATE_SUPPORT = {
+    'jpg': ('mjpeg', 'JPEG'),
+    'png': ('png', 'PNG'),
+    'ppm': ('ppm', 'PPM'),
+    'pam': ('pam', 'PAM'),
+    'bmp': ('bmp', 'BMP'),
+    'tiff': ('tiff', 'TIFF'),
+    'qoi': ('qoi', 'QOI'),
+}
+# Pillow format and save options for the intermediate formats
+PILLOW_FORMATS = {
+    'jpg': ('JPEG', {'quality': 92}),
+    'png': ('PNG', {'compress_level': 1}),
+    'ppm': ('PPM', {}),
+    'bmp': ('BMP', {}),
+    'tiff': ('TIFF', {}),
+    'qoi': ('QOI', {}),
+}
+# Format names used by `read_image_info` for the intermediate formats
+INTERMEDIATE_HEADER = {'jpg': 'jpeg', 'png': 'png', 'bmp': 'bmp',
+                       'tiff': 'tiff'}
+# Rough size in bytes per pixel of the intermediate formats for photos
+INTERMEDIATE_BYTES = {
+    'jpg': 0.3,
+    'png': 1.8,
+    'ppm': 3.0,
+    'pam': 3.0,
+    'bmp': 3.0,
+    'tiff': 3.0,
+    'qoi': 2.2,
+}
+# Ken Burns effect: zoom factor at the peak of the motion and the largest
+# zoom used to hide the borders of pictures with a different aspect ratio
+KEN_BURNS_ZOOM = 1.15
+KEN_BURNS_MAX_FIT = 1.5
+# zoompan crops at whole pixels, so the picture is scaled up first (at most
+# this factor and this width) to let the motion move in sub-pixel steps
+KEN_BURNS_OVERSAMPLE = 4
+KEN_BURNS_MAX_WIDTH = 8192
+# Largest Hamming distance between the 64 bit difference hashes of two
+# pictures to treat them as duplicates
+DEDUP_THRESHOLD = 4
+DEDUP_MAX = 10
+# Increased whenever calibrate measures a different pipeline, so cached
+# results of older versions are not used
+CALIBRATION_REVISION = 4
+MAGICK = ('convert', 'mogrify', 'montage')
+# Largest distance between two keyframes of the movies in seconds, so
+# seeking inside a slide does not decode the whole slide
+KEYFRAME_INTERVAL = 2
 EXECUTABLES = {
     'ffmpeg': 'ffmpeg',
     'convert': 'convert',
@@ -64,6 +148,24 @@ TAGFILE_CONTENT = """\
     </Tag>
 </Tags>
 """
+CHAPTERS_CONTENT = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE Chapters SYSTEM "matroskachapters.dtd">
+
+<Chapters>
+    <EditionEntry>
+{atoms}
+    </EditionEntry>
+</Chapters>
+"""
+CHAPTER_ATOM = """\
+        <ChapterAtom>
+            <ChapterTimeStart>{start}</ChapterTimeStart>
+            <ChapterDisplay>
+                <ChapterString>{name}</ChapterString>
+                <ChapterLanguage>und</ChapterLanguage>
+            </ChapterDisplay>
+        </ChapterAtom>"""
 BUILDFILE_CONTENT = """\
 # -*- coding: utf-8 -*-
 
@@ -100,6 +202,15 @@ AUDIO = []
 #                     4k (4096x2304, 60Hz)
 PROFILE = '1080p'
 
+# Seconds to crossfade between two audio tracks (0 to simply join them).
+CROSSFADE = 0
+
+# Normalize the loudness of the soundtrack (EBU R128).
+LOUDNORM = False
+
+# Codec for the soundtrack, aac or opus.
+AUDIO_CODEC = 'aac'
+
 # Time to display each image in seconds.
 IMAGE_DURATION = 5
 
@@ -128,11 +239,37 @@ BACKGROUND = 'black'
 # Color for title and epilog text.
 TEXTCOLOR = 'white'
 
+# File format for the pictures in the working directory. One of jpg, png,
+# ppm, pam, bmp, tiff or qoi. jpg loses quality with every processing step,
+# png and qoi (needs recent versions of ImageMagick and ffmpeg) are
+# lossless, ppm and pam are lossless and fastest, but need about ten times
+# the space of jpg.
+INTERMEDIATE = 'jpg'
+
+# Slowly zoom and pan over each picture (Ken Burns effect).
+KEN_BURNS = False
+
+# Leave out near-duplicate pictures (burst shots, multiple exports). Set to
+# the allowed difference (0-10, 4 is a good start) to enable. NumPy must be
+# installed for this.
+DEDUP = None
+
+# Directory for a HLS playlist which grows while the show is built, so
+# playback can start long before the MKV file is finished. None disables
+# streaming.
+STREAM = None
+
 # Working directory for temporary files (for a show with 4 pictures about
-# 120MB free space is needed)
+# 120MB free space is needed with jpg as intermediate format, run
+# `python ffmagick.py slideshow --plan ...` or `plan()` for an estimate)
 # If None (the default) your systems temporary directory is used.
 WORKDIR = None
 
+# Program used for the image processing, imagemagick or pillow. pillow does
+# all the work inside Python (Pillow must be installed) and is much faster
+# for shows with many pictures.
+BACKEND = 'imagemagick'
+
 # Mapping for the needed external programs if not in your PATH.
 EXECUTABLES = {{
     'convert': r'convert{exe}',
@@ -168,18 +305,154 @@ if __name__ == '__main__':
         textcolor=TEXTCOLOR,
         workdir=WORKDIR,
         executables=EXECUTABLES,
+        intermediate=INTERMEDIATE,
+        ken_burns=KEN_BURNS,
+        dedup=DEDUP,
+        stream=STREAM,
+        crossfade=CROSSFADE,
+        loudnorm=LOUDNORM,
+        audio_codec=AUDIO_CODEC,
+        backend=BACKEND,
     )
 """.format(font=DEFAULT_FONT, exe=_exe,
            out=os.path.join(os.getcwd(), 'slideshow.mkv'))
 
 
+class ImageInfo(namedtuple('ImageInfo', 'format width height orientation '
+                                         'colorspace')):
+    """Header data of a picture, see `read_image_info`. Width and height
+       are stored as in the file, `size` gives them after applying the EXIF
+       orientation."""
+
+    __slots__ = ()
+
+    @property
+    def size(self):
+        if self.orientation in (5, 6, 7, 8):
+            return (self.height, self.width)
+        return (self.width, self.height)
+
+
+class Capabilities:
+    """Versions and features of the external programs, see
+       `probe_toolchain`."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def found(self, prog):
+        return self.data['paths'].get(prog) is not None
+
+    @property
+    def ffmpeg_version(self):
+        return self.data['ffmpeg']['version']
+
+    @property
+    def filters(self):
+        return set(self.data['ffmpeg']['filters'])
+
+    @property
+    def encoders(self):
+        return set(self.data['ffmpeg']['encoders'])
+
+    @property
+    def decoders(self):
+        return set(self.data['ffmpeg']['decoders'])
+
+    @property
+    def magick_version(self):
+        return self.data['magick']['version']
+
+    @property
+    def magick_formats(self):
+        return set(self.data['magick']['formats'])
+
+    @property
+    def fonts(self):
+        return self.data['magick']['fonts']
+
+    @property
+    def font_files(self):
+        return self.data['magick'].get('font_files', {})
+
+    @property
+    def magick_resources(self):
+        return self.data['magick'].get('resources', {})
+
+    @property
+    def mkvmerge_version(self):
+        return self.data['mkvmerge']['version']
+
+
+class ResourcePolicy:
+    """Resource limits applied to every external program started by a
+       builder.
+
+    :parameters:
+        memory : str
+            ImageMagick memory limit, e.g. '512MiB'.
+        map : str
+            ImageMagick memory map limit, e.g. '1GiB'.
+        threads : int
+            Number of threads for ImageMagick and ffmpeg.
+        address_space : int
+            Hard limit for the address space of each child process in
+            bytes (RLIMIT_AS, set with prlimit, so only on Linux).
+    """
+
+    def __init__(self, memory=None, map=None, threads=None,
+                 address_space=None):
+        self.memory = memory
+        self.map = map
+        self.threads = threads
+        self.address_space = address_space
+
+    def with_defaults(self, limits):
+        """Return a copy with the values not set taken from `limits`, the
+           resource limits ImageMagick reports (see `probe_toolchain`).
+           This way ffmpeg uses the same number of threads as ImageMagick.
+        """
+        threads = self.threads
+        if threads is None and limits.get('thread', '').isdigit():
+            threads = int(limits['thread'])
+        return ResourcePolicy(self.memory or limits.get('memory'),
+                              self.map or limits.get('map'), threads,
+                              self.address_space)
+
+    def magick_args(self):
+        args = []
+        for name, value in (('memory', self.memory), ('map', self.map),
+                            ('thread', self.threads)):
+            if value is not None:
+                args.extend(['-limit', name, str(value)])
+        return args
+
+    def ffmpeg_args(self):
+        if self.threads is None:
+            return []
+        return ['-threads', str(self.threads)]
+
+    def limit(self, pid):
+        # Set from the parent after starting the process, a preexec_fn is
+        # not safe while several threads start processes
+        prlimit = getattr(resource, 'prlimit', None)
+        if self.address_space is None or prlimit is None:
+            return
+        limit = self.address_space
+        try:
+            prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+        except ProcessLookupError:
+            pass
+
+
 class Profile:
 
-    def __init__(self, width, height, fps, fontsize=None):
+    def __init__(self, width, height, fps, fontsize=None, resources=None):
         self.width = width
         self.height = height
         self.fps = fps
         self.fontsize = fontsize
+        self.resources = resources or ResourcePolicy()
 
     @property
     def size(self):
@@ -209,28 +482,108 @@ PROFILES = {
 
 class Base:
 
-    def __init__(self, workdir, executables, outfile=None):
-        workdir = workdir or gettempdir()
-        _name = 'ffmagick-{}-'.format(self.__class__.__name__)
-        self.tmp = _get_name(workdir, _name)
-        os.mkdir(self.tmp)
+    def __init__(self, workdir, executables, outfile=None, resources=None):
+        self.workdir = workdir or gettempdir()
+        # created by _make_tmp after the checks of the subclass, so a
+        # builder failing to start leaves nothing behind
+        self.tmp = None
         self.exe = EXECUTABLES.copy()
         if executables:
             self.exe.update(executables)
         self.outfile = outfile
+        self.caps = probe_toolchain(self.exe)
+        self.resources = (resources or ResourcePolicy()).with_defaults(
+            self.caps.magick_resources
+        )
         self.process_time = None
+        self.events = None
+        self.frames_total = 0
+        self.tasks_total = 0
         self._automate = []
 
     def __iter__(self):
         start = time.time()
+        self._emit('totals', frames=self.frames_total, tasks=self.tasks_total)
         for desc, func in self._automate:
             _start = time.time()
             func()
-            yield desc, time.time() - _start
+            duration = time.time() - _start
+            self._emit('stage', stage=desc, duration=duration)
+            yield desc, duration
         self.process_time = time.time() - start
 
     def cleanup(self):
-        shutil.rmtree(self.tmp)
+        if self.tmp is not None:
+            shutil.rmtree(self.tmp)
+
+    def _make_tmp(self):
+        _name = 'ffmagick-{}-'.format(self.__class__.__name__)
+        self.tmp = _get_name(self.workdir, _name)
+        os.mkdir(self.tmp)
+
+    def _command(self, cmd, output=None):
+        # `output` is appended last, for ffmpeg the output options of the
+        # resource policy are put in front of it
+        prog = None
+        for name, exe in self.exe.items():
+            if exe == cmd[0]:
+                prog = name
+                break
+        if prog in MAGICK:
+            cmd = cmd[:1] + self.resources.magick_args() + cmd[1:]
+        elif prog == 'ffmpeg':
+            cmd = cmd + self.resources.ffmpeg_args()
+        if output is not None:
+            cmd = cmd + [output]
+        return list(cmd)
+
+    def _popen(self, cmd, output=None, **kwargs):
+        p = subprocess.Popen(self._command(cmd, output), **kwargs)
+        self.resources.limit(p.pid)
+        return p
+
+    def _run(self, cmd, output=None, **kwargs):
+        p = self._popen(cmd, output, **kwargs)
+        if p.wait():
+            raise subprocess.CalledProcessError(p.returncode, p.args)
+
+    def _encode(self, cmd, frames, feed=None, output=None):
+        """Run ffmpeg and report the encoded frames while it is running.
+           If given, the chunks from the iterable `feed` are written to the
+           standard input of ffmpeg."""
+        cmd = cmd[:1] + ['-nostats', '-progress', 'pipe:1'] + cmd[1:]
+        p = self._popen(cmd, output, stdout=subprocess.PIPE,
+                        stderr=subprocess.DEVNULL,
+                        stdin=subprocess.PIPE if feed else None)
+        if feed is not None:
+            writer = Thread(target=_feed, args=(p.stdin, feed))
+            writer.start()
+        done = 0
+        for line in p.stdout:
+            key, _, value = line.decode('utf-8').strip().partition('=')
+            if key == 'frame' and value.isdigit():
+                num = min(int(value), frames)
+                if num > done:
+                    self._emit('frames', frames=num - done)
+                    done = num
+        if feed is not None:
+            writer.join()
+        if p.wait():
+            raise subprocess.CalledProcessError(p.returncode, p.args)
+        if done < frames:
+            self._emit('frames', frames=frames - done)
+
+    def _emit(self, kind, **data):
+        if self.events is not None:
+            data.update(kind=kind, builder=self.__class__.__name__)
+            self.events.put(data)
+
+    def _output(self, cmd, output=None, **kwargs):
+        p = self._popen(cmd, output, stdout=subprocess.PIPE, **kwargs)
+        out, _ = p.communicate()
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, p.args, out)
+        return out
 
 
 class VideoBuilder(Base):
@@ -239,10 +592,30 @@ class VideoBuilder(Base):
                  title='', background='black', textcolor='white',
                  font=DEFAULT_FONT, workdir=None, author='', epilog='',
                  executables=None, image_duration=5, transition_duration=1,
-                 remove_tempfiles=True):
-        Base.__init__(self, workdir, executables)
+                 remove_tempfiles=True, intermediate='jpg', ken_burns=False,
+                 dedup=None, stream=None):
+        if intermediate not in INTERMEDIATE_FORMATS:
+            raise ValueError('Unknown intermediate format: {}'.format(
+                intermediate
+            ))
+        Base.__init__(self, workdir, executables,
+                      resources=profile.resources)
+        self.ext = intermediate
+        self.ken_burns = ken_burns
+        self.font = font
+        self._check_toolchain()
         self.source_pictures = _get_pictures(pictures)
+        self.duplicates = []
+        if dedup is not None:
+            if not 0 <= dedup <= DEDUP_MAX:
+                raise ValueError('Dedup distance must be between 0 and '
+                                 '{}: {}'.format(DEDUP_MAX, dedup))
+            self._remove_duplicates(dedup)
+        self.info = {pic: read_image_info(pic) for pic in self.source_pictures}
         self.pictures = []
+        self.thumbnails = []
+        self._sized = set()
+        self.sizes = {}
         self.first = None
         self.last = None
         self._last_num = None
@@ -251,19 +624,24 @@ class VideoBuilder(Base):
         self.title = title
         self.background = background
         self.textcolor = textcolor
-        self.font = font
         self.author = author
         self.epilog = epilog
         self.image_duration = image_duration
         self.transition_duration = transition_duration
         self.remove_tempfiles = remove_tempfiles
+        self._make_tmp()
         self.dirs = dict(
             pics=os.path.join(self.tmp, 'pictures'),
             anim_pics=os.path.join(self.tmp, 'animation_pictures'),
             movs=os.path.join(self.tmp, 'movies'),
+            thumbs=os.path.join(self.tmp, 'thumbnails'),
         )
         for d in self.dirs.values():
             os.mkdir(d)
+        self._count_work()
+        self.stream = None
+        if stream:
+            self.stream = HLSPlaylist(stream, self._segment_durations())
         self._automate = (
             ('Copied source files to workdir', self.copy_source_files),
             ('Created first picture with fade-in', self.create_first_picture),
@@ -274,31 +652,255 @@ class VideoBuilder(Base):
             # ('Created movies for transitions',
             # self.create_transition_movies),
             ('Created small movies', self.create_movies),
-            ('Created video only MKV file', self.create_video_only_mkv),
+            ('Wrote MKVMerge options for the show', self.create_mkv_options),
+        )
+
+    def _check_toolchain(self):
+        for prog in ('ffmpeg', 'mkvmerge'):
+            if not self.caps.found(prog):
+                raise ValueError('{} not found ({})'.format(
+                    prog, self.exe[prog]
+                ))
+        needed = [('encoder', 'libx264', self.caps.encoders),
+                  ('filter', 'fade', self.caps.filters)]
+        if self.ken_burns:
+            needed.extend([('filter', 'zoompan', self.caps.filters),
+                           ('filter', 'scale', self.caps.filters)])
+        decoder, fmt = INTERMEDIATE_SUPPORT[self.ext]
+        needed.append(('decoder', decoder, self.caps.decoders))
+        for kind, name, available in needed:
+            if name not in available:
+                raise ValueError('ffmpeg has no {} {}'.format(kind, name))
+        self._check_imaging(fmt)
+
+    def _check_imaging(self, fmt):
+        for prog in MAGICK:
+            if not self.caps.found(prog):
+                raise ValueError('{} not found ({})'.format(
+                    prog, self.exe[prog]
+                ))
+        if fmt not in self.caps.magick_formats:
+            raise ValueError('ImageMagick can not write {}'.format(fmt))
+        # ImageMagick takes a font name from its list or a font file
+        if self.caps.fonts and not self._known_font():
+            raise ValueError('Font not found: {} (see list_fonts)'.format(
+                self.font
+            ))
+
+    def _known_font(self):
+        if os.path.isfile(self.font) or self.font in self.caps.fonts:
+            return True
+        # the font may be installed after the fonts were cached
+        self.caps = probe_toolchain(self.exe, refresh=True)
+        return self.font in self.caps.fonts
+
+    def _remove_duplicates(self, threshold):
+        if np is None:
+            raise ImportError('NumPy is needed to find duplicate pictures')
+        workers = self.resources.threads or os.cpu_count()
+        with ThreadPoolExecutor(workers) as pool:
+            thumbs = list(pool.map(self._hash_thumbnail,
+                                   self.source_pictures))
+        hashes = _dhash(np.stack(thumbs))
+        keep = []
+        for pic, dup in zip(self.source_pictures,
+                            _find_duplicates(hashes, threshold)):
+            if dup:
+                self.duplicates.append(pic)
+            else:
+                keep.append(pic)
+        self.source_pictures = keep
+
+    def _hash_thumbnail(self, pic):
+        # 9x8 grayscale pixels, decoded at reduced size where possible
+        cmd = [self.exe['convert'], '-define', 'jpeg:size=64x64',
+               '{}[0]'.format(pic), '-auto-orient', '-colorspace', 'gray',
+               '-resize', '9x8!', '-depth', '8', 'gray:-']
+        data = self._output(cmd)
+        return np.frombuffer(data, dtype=np.uint8).reshape(8, 9)
+
+    def _route(self, pic):
+        """Cheapest way to bring a source picture to the profile: 'copy'
+           the file as it is, 'rotate' it only or 'scale' it."""
+        info = self.info[pic]
+        if info is None or info.size != self.profile.size or \
+                info.colorspace not in ('ycbcr', 'rgb', 'gray'):
+            return 'scale'
+        if info.orientation == 1 and \
+                info.format == INTERMEDIATE_HEADER.get(self.ext):
+            return 'copy'
+        return 'rotate'
+
+    def _count_work(self):
+        num = len(self.source_pictures)
+        fps = self.profile.fps
+        # copy, resize and morph per picture, plus title and epilog
+        self.tasks_total = 3 * num + 5
+        # title and epilog are encoded twice (the second time with fade)
+        self.frames_total = (
+            4 * (self.image_duration + 2) * fps +
+            num * self.image_duration * fps +
+            (num + 1) * self.transition_duration * fps
         )
 
+    @property
+    def duration(self):
+        return sum(self._segment_durations())
+
+    def _segment_durations(self):
+        # title, then transition and picture alternating, then epilog
+        durations = [self.image_duration + 2]
+        for _ in self.source_pictures:
+            durations.extend([self.transition_duration, self.image_duration])
+        durations.extend([self.transition_duration, self.image_duration + 2])
+        return durations
+
+    def probe_sizes(self):
+        """Return the size (width, height) of every source picture without
+           decoding the pictures."""
+        unknown = [pic for pic in self.source_pictures
+                   if self.info[pic] is None]
+        found = dict(zip(unknown, self._ping_sizes(unknown)))
+        return [found[pic] if self.info[pic] is None else self.info[pic].size
+                for pic in self.source_pictures]
+
+    def _ping_sizes(self, pictures):
+        sizes = []
+        for start in range(0, len(pictures), 100):
+            cmd = [self.exe['convert'], '-ping']
+            cmd.extend('{}[0]'.format(pic) for pic in
+                       pictures[start:start + 100])
+            cmd.extend(['-format', '%w %h\\n', 'info:'])
+            for line in self._output(cmd).splitlines():
+                w, h = line.split()
+                sizes.append((int(w), int(h)))
+        return sizes
+
+    def plan_tasks(self, sizes):
+        """List the work of every stage as dictionaries with the stage, the
+           program, the number of calls and the megapixels written (image
+           tasks) or the frames encoded (movies). Image tasks not measured
+           by the copy rate of calibrate name their rate in the model."""
+        num = len(self.source_pictures)
+        fps = self.profile.fps
+        mpix = self.profile.width * self.profile.height / 1e6
+        routes = [self._route(pic) for pic in self.source_pictures]
+        src = sum(w * h for (w, h), route in zip(sizes, routes)
+                  if route != 'copy') / 1e6
+        morph = (num + 1) * fps * self.transition_duration
+        tasks = [
+            dict(stage='Copied source files to workdir', tool='convert',
+                 count=num - routes.count('copy'), mpixels=src),
+            dict(stage='Created first picture with fade-in', tool='montage',
+                 count=2 if self.title else 1, mpixels=mpix),
+            dict(stage='Created last picture with fade-out', tool='convert',
+                 count=1, mpixels=mpix),
+            dict(stage='Resized pictures according to profile',
+                 tool='mogrify', count=1, mpixels=mpix),
+            dict(stage='Created animation pictures', tool='convert',
+                 count=num + 1, mpixels=morph * mpix,
+                 rate='morph_mpixel_seconds'),
+        ]
+        return tasks + self._plan_movies()
+
+    def _plan_movies(self):
+        num = len(self.source_pictures)
+        fps = self.profile.fps
+        tasks = [
+            dict(stage='Created movies for pictures', tool='ffmpeg',
+                 count=num + 4, frames=self.frames_total - (num + 1) *
+                 fps * self.transition_duration),
+            dict(stage='Created movies for transitions', tool='ffmpeg',
+                 count=num + 1,
+                 frames=(num + 1) * fps * self.transition_duration),
+            dict(stage='Assembled the final MKV file', tool='mkvmerge',
+                 count=1, frames=0),
+        ]
+        return tasks
+
+    def plan_workdir(self, sizes):
+        """Estimate the largest amount of bytes in the working directory
+           before the movies are created."""
+        pic = self.profile.width * self.profile.height * \
+            INTERMEDIATE_BYTES[self.ext]
+        morph = (len(sizes) + 1) * self.profile.fps * \
+            self.transition_duration * pic
+        return (len(sizes) + 2) * pic + morph
+
+    def _publish(self, movie):
+        if self.stream is None:
+            return
+        name = os.path.splitext(os.path.basename(movie))[0]
+        num = int(name.split('-')[-1])
+        cmd = [self.exe['ffmpeg'], '-y', '-i', movie, '-c', 'copy',
+               '-bsf:v', 'h264_mp4toannexb', '-output_ts_offset',
+               str(self.stream.offset(num)), '-f', 'mpegts']
+        self._run(cmd, output=self.stream.segment(num),
+                  stderr=subprocess.DEVNULL)
+        self.stream.add(num)
+
     def copy_source_files(self):
+        if len(self.source_pictures) < 4:
+            raise ValueError('You must at least have 4 pictures in your show!')
+        # The title montage only needs small versions of four pictures, so
+        # they are written as thumbnails while the picture is decoded anyway
+        nums = _get_sample_numbers(len(self.source_pictures))
+        thumb_size = '{}x{}'.format(*self.profile.montage_size)
+        size = '{}x{}'.format(*self.profile.size)
         i = 3
-        for pic in self.source_pictures:
-            dest = os.path.join(self.dirs['pics'], 'pic-{:>06d}.jpg'.format(i))
-            cmd = [self.exe['convert'], pic, '-auto-orient', dest]
-            subprocess.check_call(cmd)
+        for n, pic in enumerate(self.source_pictures):
+            dest = os.path.join(self.dirs['pics'],
+                                'pic-{:>06d}.{}'.format(i, self.ext))
+            info = self.info[pic]
+            route = self._route(pic)
+            if route == 'copy' and n not in nums:
+                shutil.copyfile(pic, dest)
+            else:
+                cmd = [self.exe['convert']]
+                if route == 'scale' and info is not None:
+                    # let libjpeg decode at the smallest sufficient scale
+                    cmd.extend(['-define', 'jpeg:size={}x{}'.format(
+                        *_draft_size((info.width, info.height),
+                                     info.orientation, self.profile.size)
+                    )])
+                cmd.extend([pic, '-auto-orient'])
+                if self.ken_burns and info is None:
+                    # The motion depends on the size before letterboxing
+                    cmd.extend(['-print', '%w %h\\n'])
+                if n in nums:
+                    thumb = os.path.join(
+                        self.dirs['thumbs'],
+                        'thumb-{:>06d}.{}'.format(i, self.ext)
+                    )
+                    cmd.extend(['(', '+clone', '-thumbnail', thumb_size,
+                                '-write', thumb, '+delete', ')'])
+                    self.thumbnails.append(thumb)
+                if route == 'scale':
+                    cmd.extend(['-resize', size, '-background', 'black',
+                                '-gravity', 'center', '-extent', size])
+                cmd.append(dest)
+                if self.ken_burns and info is None:
+                    w, h = self._output(cmd).split()
+                    self.sizes[dest] = (int(w), int(h))
+                else:
+                    self._run(cmd)
+            if info is not None:
+                self.sizes[dest] = info.size
+            self._sized.add(dest)
+            self._emit('task')
             self.pictures.append(dest)
             i += 2
         self._last_num = i
 
     def create_first_picture(self):
-        if len(self.pictures) < 4:
-            raise ValueError('You must at least have 4 pictures in your show!')
-        nums = _get_sample_numbers(len(self.pictures))
-        pics = [self.pictures[x] for x in nums]
-        _out = os.path.join(self.dirs['pics'], 'pic-000001.jpg')
+        _out = os.path.join(self.dirs['pics'],
+                            'pic-000001.{}'.format(self.ext))
         if self.title:
-            out = os.path.join(self.tmp, 'title_raw.jpg')
+            out = os.path.join(self.tmp, 'title_raw.{}'.format(self.ext))
         else:
             out = _out
         cmd = [self.exe['montage'], '-tile', '2x']
-        cmd.extend(pics)
+        cmd.extend(self.thumbnails)
         cmd.extend([
             '-geometry',
             '{}x{}+10+50'.format(
@@ -308,17 +910,17 @@ class VideoBuilder(Base):
             self.background,
             out
         ])
-        subprocess.check_call(cmd)
+        self._run(cmd)
         if self.title:
             cmd = [self.exe['convert'], out, '-gravity', 'center', '-font',
                    self.font, '-pointsize', str(self.profile.fontsize),
                    '-fill', self.textcolor,
                    '-draw', "text 0,0 '{}'".format(self.title), _out]
-            subprocess.check_call(cmd)
+            self._run(cmd)
+        self._emit('task')
         self.first = _out
 
-    def create_last_picture(self):
-        w, h = self.profile.size
+    def _epilog_lines(self):
         text = []
         now = date.today()
         if not self.author and not self.epilog:
@@ -328,13 +930,20 @@ class VideoBuilder(Base):
                 text.append('\xa9 {} {}'.format(now.year, self.author))
             if self.epilog:
                 text.append(self.epilog)
+        return text
+
+    def create_last_picture(self):
+        w, h = self.profile.size
+        text = self._epilog_lines()
         out = os.path.join(self.dirs['pics'],
-                           'pic-{:>06d}.jpg'.format(self._last_num))
+                           'pic-{:>06d}.{}'.format(self._last_num, self.ext))
         cmd = [self.exe['convert'], '-size', '{}x{}'.format(w, h),
                '-background', self.background, '-fill', self.textcolor,
                '-font', self.font, '-pointsize', str(self.profile.fontsize),
                '-gravity', 'center', 'label:{}'.format('\n'.join(text)), out]
-        subprocess.check_call(cmd)
+        self._run(cmd)
+        self._emit('task')
+        self._sized.add(out)
         self.last = out
 
     def resize_pictures(self):
@@ -342,9 +951,11 @@ class VideoBuilder(Base):
         size = '{}x{}'.format(*self.profile.size)
         pics = [self.first] + self.pictures + [self.last]
         for pic in pics:
-            cmd = [self.exe['mogrify'], '-resize', size, '-background',
-                   'black', '-gravity', 'center', '-extent', size, pic]
-            subprocess.check_call(cmd)
+            if pic not in self._sized:
+                cmd = [self.exe['mogrify'], '-resize', size, '-background',
+                       'black', '-gravity', 'center', '-extent', size, pic]
+                self._run(cmd)
+            self._emit('task')
 
     def create_anim_pictures(self):
         pics = [self.first] + self.pictures + [self.last]
@@ -352,40 +963,57 @@ class VideoBuilder(Base):
         frames = self.profile.fps * self.transition_duration - 2
         for pic1, pic2 in _pairwise(pics):
             d = os.path.join(self.dirs['anim_pics'], 'morph-{:>06d}'.format(i))
-            full = os.path.join(d, '%03d.jpg')
+            full = os.path.join(d, '%03d.{}'.format(self.ext))
             os.mkdir(d)
             cmd = [self.exe['convert'], pic1, pic2, '-morph', str(frames),
                    full]
             self.anim_nums.append(i)
-            subprocess.check_call(cmd)
+            self._run(cmd)
+            self._emit('task')
             i += 2
 
     def create_small_movies(self):
         self._create_first_movie()
         # length = len(self.pictures)
+        frames = self.image_duration * self.profile.fps
         for pic in self.pictures:
             _name = os.path.basename(pic)
             name, _ = os.path.splitext(_name)
             out = os.path.join(self.dirs['movs'], 'mov-{}.mp4'.format(name))
-            cmd = [self.exe['ffmpeg'], '-loop', '1', '-i', pic, '-c:v',
-                   'libx264', '-t', str(self.image_duration), '-r',
-                   str(self.profile.fps), '-pix_fmt', 'yuv420p', out]
-            subprocess.check_call(cmd, stderr=subprocess.DEVNULL)
+            if self.ken_burns:
+                vf = _ken_burns_filter(self.sizes[pic], self.profile, frames)
+                cmd = [self.exe['ffmpeg'], '-i', pic, '-vf', vf, '-frames:v',
+                       str(frames)]
+            else:
+                cmd = [self.exe['ffmpeg'], '-loop', '1', '-i', pic, '-t',
+                       str(self.image_duration)]
+            cmd.extend(_x264(self.profile.fps) + [
+                '-r', str(self.profile.fps), '-pix_fmt', 'yuv420p'
+            ])
+            self._encode(cmd, frames, output=out)
+            self._publish(out)
             if self.remove_tempfiles:
-                os.remove(pic)
+                self._release(pic)
         self._create_last_movie()
 
+    def _release(self, pic):
+        os.remove(pic)
+
     def create_transition_movies(self):
         anims = os.listdir(self.dirs['anim_pics'])
         anims.sort()
+        frames = self.profile.fps * self.transition_duration
         for folder in anims:
             num = folder.split('-')[1]
-            inp = os.path.join(self.dirs['anim_pics'], folder, '%03d.jpg')
+            inp = os.path.join(self.dirs['anim_pics'], folder,
+                               '%03d.{}'.format(self.ext))
             out = os.path.join(self.dirs['movs'], 'mov-pic-{}.mp4'.format(num))
             cmd = [self.exe['ffmpeg'], '-r', str(self.profile.fps), '-i',
-                   inp, '-c:v', 'libx264', '-vf',
-                   'fps={},format=yuv420p'.format(self.profile.fps), out]
-            subprocess.check_call(cmd, stderr=subprocess.DEVNULL)
+                   inp, '-vf', 'fps={},format=yuv420p'.format(
+                       self.profile.fps
+                   )] + _x264(self.profile.fps)
+            self._encode(cmd, frames, output=out)
+            self._publish(out)
             if self.remove_tempfiles:
                 shutil.rmtree(os.path.join(self.dirs['anim_pics'], folder))
 
@@ -395,27 +1023,27 @@ class VideoBuilder(Base):
         self.create_transition_movies()
         p.join()
 
-    def create_video_only_mkv(self):
-        opts = os.path.join(self.tmp, 'video_only.txt')
-        out = os.path.join(self.tmp, 'video_only.mkv')
+    def create_mkv_options(self):
+        # the segments are not joined here, the options are handed to the
+        # Muxer which writes the final file in one run
+        opts = os.path.join(self.tmp, 'video.txt')
         files = [os.path.join(self.dirs['movs'], x) for x in
                  os.listdir(self.dirs['movs'])]
         files.sort()
         tags_file = self._create_tags_file()
+        chapters_file = self._create_chapters_file()
         with open(opts, 'w', encoding='utf-8') as fp:
-            fp.write('-o\n{}\n'.format(out.replace('\\', '/')))
             if self.title:
                 fp.write('--title\n')
                 fp.write('{}\n'.format(self.title))
             fp.write('--global-tags\n')
-            fp.write('{}\n\n'.format(tags_file.replace('\\', '/')))
+            fp.write('{}\n'.format(tags_file.replace('\\', '/')))
+            fp.write('--chapters\n')
+            fp.write('{}\n\n'.format(chapters_file.replace('\\', '/')))
             fp.write('{}\n'.format(files[0].replace('\\', '/')))
             for f in files[1:]:
                 fp.write('+{}\n'.format(f.replace('\\', '/')))
-        cmd = [self.exe['mkvmerge'], '@{}'.format(opts)]
-        subprocess.check_call(cmd, stdout=subprocess.DEVNULL,
-                              stderr=subprocess.DEVNULL)
-        self.outfile = out
+        self.outfile = opts
 
     def _create_tags_file(self):
         out = os.path.join(self.tmp, 'tags.xml')
@@ -428,123 +1056,584 @@ class VideoBuilder(Base):
             fp.write(text)
         return out
 
+    def _create_chapters_file(self):
+        out = os.path.join(self.tmp, 'chapters.xml')
+        durations = self._segment_durations()
+        chapters = [(0, self.title or 'Title')]
+        for i, pic in enumerate(self.source_pictures):
+            start = sum(durations[:2 + 2 * i])
+            chapters.append((start, os.path.basename(pic)))
+        chapters.append((sum(durations[:-1]), 'Epilog'))
+        atoms = [CHAPTER_ATOM.format(start=get_timecode(start),
+                                     name=escape(name))
+                 for start, name in chapters]
+        with open(out, 'w', encoding='utf-8') as fp:
+            fp.write(CHAPTERS_CONTENT.format(atoms='\n'.join(atoms)))
+        return out
+
     def _create_first_movie(self):
         duration = self.image_duration + 2
+        frames = duration * self.profile.fps
         tmp_out = os.path.join(self.tmp, 'first.mp4')
         cmd = [self.exe['ffmpeg'], '-loop', '1', '-i', self.first,
                '-c:v', 'libx264', '-t', str(duration), '-r',
-               str(self.profile.fps), '-y', '-pix_fmt', 'yuv420p', tmp_out]
-        subprocess.check_call(cmd, stderr=subprocess.DEVNULL)
+               str(self.profile.fps), '-y', '-pix_fmt', 'yuv420p']
+        self._encode(cmd, frames, output=tmp_out)
         out = os.path.join(self.dirs['movs'], 'mov-pic-000001.mp4')
         cmd = [self.exe['ffmpeg'], '-i', tmp_out, '-y', '-vf',
-               'fade=in:0:{}'.format(self.profile.fps * 2), out]
-        subprocess.check_call(cmd, stderr=subprocess.DEVNULL)
+               'fade=in:0:{}'.format(self.profile.fps * 2)]
+        cmd.extend(_x264(self.profile.fps))
+        self._encode(cmd, frames, output=out)
+        self._publish(out)
 
     def _create_last_movie(self):
         duration = self.image_duration + 2
+        frames = duration * self.profile.fps
         begin = duration * self.profile.fps - 2 * self.profile.fps
         tmp_out = os.path.join(self.tmp, 'last.mp4')
         cmd = [self.exe['ffmpeg'], '-loop', '1', '-i', self.last,
                '-c:v', 'libx264', '-t', str(duration), '-r',
-               str(self.profile.fps), '-y', '-pix_fmt', 'yuv420p', tmp_out]
-        subprocess.check_call(cmd, stderr=subprocess.DEVNULL)
+               str(self.profile.fps), '-y', '-pix_fmt', 'yuv420p']
+        self._encode(cmd, frames, output=tmp_out)
         _name = os.path.basename(self.last)
         name, _ = os.path.splitext(_name)
         out = os.path.join(self.dirs['movs'], 'mov-{}.mp4'.format(name))
         cmd = [self.exe['ffmpeg'], '-i', tmp_out, '-y', '-vf',
-               'fade=out:{}:{}'.format(begin, self.profile.fps * 2), out]
-        subprocess.check_call(cmd, stderr=subprocess.DEVNULL)
+               'fade=out:{}:{}'.format(begin, self.profile.fps * 2)]
+        cmd.extend(_x264(self.profile.fps))
+        self._encode(cmd, frames, output=out)
+        self._publish(out)
+
+
+class PillowVideoBuilder(VideoBuilder):
+    """VideoBuilder doing all image processing with Pillow inside the
+       Python process instead of starting ImageMagick for every picture.
+       Pictures are decoded at reduced size where the format allows it and
+       letterboxed while copying, transitions are blended in memory and
+       piped to ffmpeg without writing the frames to disk.
+    """
+
+    def __init__(self, *args, **kwargs):
+        VideoBuilder.__init__(self, *args, **kwargs)
+        self._users = {}
+        # created in create_movies, a lock can not be sent to the process
+        # building the show
+        self._users_lock = None
+        self._automate = (
+            ('Copied and resized source files', self.copy_source_files),
+            ('Created first picture with fade-in', self.create_first_picture),
+            ('Created last picture with fade-out', self.create_last_picture),
+            ('Created small movies', self.create_movies),
+            ('Wrote MKVMerge options for the show', self.create_mkv_options),
+        )
+
+    def _check_imaging(self, fmt):
+        if Image is None:
+            raise ImportError('Pillow is needed for the pillow backend')
+        Image.init()
+        if self.ext not in PILLOW_FORMATS or \
+                PILLOW_FORMATS[self.ext][0] not in Image.SAVE:
+            raise ValueError('Pillow can not write {}'.format(self.ext))
+        self._font_file = self._resolve_font()
+
+    def _resolve_font(self):
+        # Pillow needs a font file, ImageMagick font names are looked up in
+        # the glyph files listed by `convert -list font`
+        font = self.font
+        if not os.path.isfile(font):
+            if font not in self.caps.font_files and \
+                    not self._loads_font(font):
+                # the font may be installed after the fonts were cached
+                self.caps = probe_toolchain(self.exe, refresh=True)
+            font = self.caps.font_files.get(font, font)
+        if not self._loads_font(font):
+            raise ValueError('Font not found: {} (see list_fonts)'.format(
+                self.font
+            ))
+        return font
+
+    @staticmethod
+    def _loads_font(font):
+        try:
+            ImageFont.truetype(font, 12)
+        except OSError:
+            return False
+        return True
+
+    def _count_work(self):
+        VideoBuilder._count_work(self)
+        # resizing is done while copying, morphing while encoding
+        self.tasks_total = len(self.source_pictures) + 2
+
+    def _hash_thumbnail(self, pic):
+        with Image.open(pic) as img:
+            img.draft('L', (64, 64))
+            img = ImageOps.exif_transpose(img).convert('L')
+            img = img.resize((9, 8), Image.LANCZOS)
+        return np.asarray(img, dtype=np.uint8)
+
+    def _ping_sizes(self, pictures):
+        sizes = []
+        for pic in pictures:
+            with Image.open(pic) as img:
+                sizes.append(img.size)
+        return sizes
+
+    def plan_tasks(self, sizes):
+        num = len(self.source_pictures)
+        mpix = self.profile.width * self.profile.height / 1e6
+        copies = [self._route(pic) for pic in self.source_pictures].count(
+            'copy'
+        )
+        tasks = [
+            dict(stage='Copied and resized source files', tool='pillow',
+                 count=num - copies, mpixels=(num - copies) * mpix),
+            dict(stage='Created first picture with fade-in', tool='pillow',
+                 count=1, mpixels=mpix),
+            dict(stage='Created last picture with fade-out', tool='pillow',
+                 count=1, mpixels=mpix),
+        ]
+        movies = self._plan_movies()
+        for task in movies:
+            if task['stage'] == 'Created movies for transitions':
+                # the frames are blended while they are encoded
+                task.update(mpixels=task['frames'] * mpix,
+                            rate='morph_mpixel_seconds')
+        return tasks + movies
+
+    def plan_workdir(self, sizes):
+        pic = self.profile.width * self.profile.height * \
+            INTERMEDIATE_BYTES[self.ext]
+        return (len(sizes) + 2) * pic
+
+    def _save(self, img, filename):
+        fmt, options = PILLOW_FORMATS[self.ext]
+        img.save(filename, fmt, **options)
+
+    def _font(self):
+        return ImageFont.truetype(self._font_file, self.profile.fontsize)
+
+    def _text(self, img, text):
+        # like label: of ImageMagick, a literal `\n` starts a new line
+        text = text.replace('\\n', '\n')
+        draw = ImageDraw.Draw(img)
+        w, h = img.size
+        draw.multiline_text((w // 2, h // 2), text, fill=self.textcolor,
+                            font=self._font(), anchor='mm', align='center')
+
+    def copy_source_files(self):
+        if len(self.source_pictures) < 4:
+            raise ValueError('You must at least have 4 pictures in your show!')
+        nums = _get_sample_numbers(len(self.source_pictures))
+        i = 3
+        for n, pic in enumerate(self.source_pictures):
+            dest = os.path.join(self.dirs['pics'],
+                                'pic-{:>06d}.{}'.format(i, self.ext))
+            if self._route(pic) == 'copy' and n not in nums:
+                shutil.copyfile(pic, dest)
+                self.sizes[dest] = self.profile.size
+                self._emit('task')
+                self.pictures.append(dest)
+                i += 2
+                continue
+            with Image.open(pic) as img:
+                orientation = img.getexif().get(0x0112, 1)
+                img.draft('RGB', _draft_size(img.size, orientation,
+                                             self.profile.size))
+                img = ImageOps.exif_transpose(img).convert('RGB')
+            self.sizes[dest] = img.size
+            if n in nums:
+                thumb = img.copy()
+                thumb.thumbnail(self.profile.montage_size, Image.LANCZOS)
+                self.thumbnails.append(thumb)
+            img = ImageOps.pad(img, self.profile.size, Image.LANCZOS,
+                               color='black')
+            self._save(img, dest)
+            self._emit('task')
+            self.pictures.append(dest)
+            i += 2
+        self._last_num = i
+
+    def create_first_picture(self):
+        # Same layout as montage -tile 2x -geometry WxH+10+50 after resizing
+        width, height = self.profile.size
+        cell_w, cell_h = width // 2, height // 2
+        scale = min(width / (2 * (cell_w + 20)),
+                    height / (2 * (cell_h + 100)))
+        img = Image.new('RGB', self.profile.size, self.background)
+        for n, thumb in enumerate(self.thumbnails):
+            thumb = ImageOps.contain(
+                thumb, (int(cell_w * scale), int(cell_h * scale)),
+                Image.LANCZOS
+            )
+            x = (n % 2) * cell_w + (cell_w - thumb.width) // 2
+            y = (n // 2) * cell_h + (cell_h - thumb.height) // 2
+            img.paste(thumb, (x, y))
+        if self.title:
+            self._text(img, self.title)
+        out = os.path.join(self.dirs['pics'],
+                           'pic-000001.{}'.format(self.ext))
+        self._save(img, out)
+        self._emit('task')
+        self.first = out
+
+    def create_last_picture(self):
+        img = Image.new('RGB', self.profile.size, self.background)
+        self._text(img, '\n'.join(self._epilog_lines()))
+        out = os.path.join(self.dirs['pics'],
+                           'pic-{:>06d}.{}'.format(self._last_num, self.ext))
+        self._save(img, out)
+        self._emit('task')
+        self.last = out
+
+    def create_transition_movies(self):
+        pics = [self.first] + self.pictures + [self.last]
+        frames = self.profile.fps * self.transition_duration
+        width, height = self.profile.size
+        num = 2
+        # Each picture is decoded once and reused for the next transition
+        img2 = _load_rgb(pics[0])
+        for prev, pic in _pairwise(pics):
+            img1, img2 = img2, _load_rgb(pic)
+            out = os.path.join(self.dirs['movs'],
+                               'mov-pic-{:>06d}.mp4'.format(num))
+            cmd = [self.exe['ffmpeg'], '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', '{}x{}'.format(width, height), '-r',
+                   str(self.profile.fps), '-i', '-', '-pix_fmt', 'yuv420p']
+            cmd.extend(_x264(self.profile.fps))
+            self._encode(cmd, frames, _blend_frames(img1, img2, frames), out)
+            self._publish(out)
+            if self.remove_tempfiles and prev in self._users:
+                self._release(prev)
+            num += 2
+
+    def create_movies(self):
+        # The pictures are read by the picture movies and the transitions
+        # at the same time, the last of them removes the file
+        self._users = dict.fromkeys(self.pictures, 2)
+        self._users_lock = Lock()
+        VideoBuilder.create_movies(self)
+
+    def _release(self, pic):
+        with self._users_lock:
+            self._users[pic] -= 1
+            if self._users[pic]:
+                return
+        os.remove(pic)
+
+
+class HLSPlaylist:
+    """HLS event playlist for the movies of a show. Segments may be added
+       in any order, the playlist only grows by the segments following
+       without a gap.
+
+    :parameters:
+        folder : str
+            Directory for the playlist and the segments.
+        durations : list
+            Duration in seconds for every segment of the show.
+    """
+
+    def __init__(self, folder, durations):
+        self.folder = os.path.abspath(folder)
+        os.makedirs(self.folder, exist_ok=True)
+        self.filename = os.path.join(self.folder, 'playlist.m3u8')
+        self.durations = durations
+        self.published = 0
+        self._ready = set()
+        self._lock = Lock()
+        self._write()
+
+    def __getstate__(self):
+        # the playlist is sent to the process building the show, which
+        # gets a lock of its own
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def segment(self, num):
+        return os.path.join(self.folder, 'segment-{:>06d}.ts'.format(num))
+
+    def offset(self, num):
+        return sum(self.durations[:num - 1])
+
+    def add(self, num):
+        with self._lock:
+            self._ready.add(num)
+            while self.published + 1 in self._ready:
+                self.published += 1
+            self._write()
+
+    def _write(self):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-PLAYLIST-TYPE:EVENT',
+            '#EXT-X-TARGETDURATION:{}'.format(
+                math.ceil(max(self.durations))
+            ),
+            '#EXT-X-MEDIA-SEQUENCE:0',
+        ]
+        for num in range(1, self.published + 1):
+            lines.append('#EXTINF:{:.3f},'.format(self.durations[num - 1]))
+            lines.append(os.path.basename(self.segment(num)))
+        if self.published == len(self.durations):
+            lines.append('#EXT-X-ENDLIST')
+        tmp = '{}.tmp'.format(self.filename)
+        with open(tmp, 'w', encoding='utf-8') as fp:
+            fp.write('\n'.join(lines))
+            fp.write('\n')
+        os.replace(tmp, self.filename)
 
 
 class AudioBuilder(Base):
+    """Build the soundtrack with a single ffmpeg run. The tracks are joined
+       (or crossfaded), optionally loudness normalized and, if a duration is
+       given, looped and cut to exactly that duration.
+
+    Looping is done by the demuxer, which reads the input again instead of
+    keeping the samples in memory. Several tracks shorter than the show
+    are therefore joined to a lossless FLAC file in the working directory
+    first (about 0.5 MB per second of audio).
+    """
 
-    def __init__(self, audio_files, workdir=None, executables=None):
-        Base.__init__(self, workdir, executables)
+    def __init__(self, audio_files, workdir=None, executables=None,
+                 resources=None, duration=None, crossfade=0, loudnorm=False,
+                 codec='aac'):
+        if codec not in AUDIO_CODECS:
+            raise ValueError('Unknown audio codec: {}'.format(codec))
+        Base.__init__(self, workdir, executables, resources=resources)
         self.audio_files = _get_audio(audio_files)
-        self.aac_files = []
+        self.duration = duration
+        self.crossfade = crossfade
+        self.loudnorm = loudnorm
+        self.codec = codec
+        self._check_toolchain()
+        self._make_tmp()
         self._automate = (
-            ('Transcoded audio files to AAC', self.transcode),
-            ('Created audio only MKV file', self.create_audio_only_mkv),
+            ('Created soundtrack', self.create_soundtrack),
         )
 
-    def transcode(self):
-        for n, f in enumerate(self.audio_files, 1):
-            out = os.path.join(self.tmp, 'audio-{:>03d}.aac'.format(n))
-            if f.lower().endswith('.aac') or f.lower().endswith('.m4a'):
-                shutil.copy(f, out)
-            else:
-                cmd = [self.exe['ffmpeg'], '-i', f, '-c:a', 'aac', '-strict',
-                       '-2', '-b:a', '256k', out]
-                subprocess.check_call(cmd, stderr=subprocess.DEVNULL)
-            self.aac_files.append(out)
-        self.aac_files.sort()
-
-    def create_audio_only_mkv(self):
-        self.outfile = os.path.join(self.tmp, 'audio_only.mkv')
-        opts = os.path.join(self.tmp, 'audio_only.txt')
-        sbr = '--aac-is-sbr\n1\n'
-        with open(opts, 'w', encoding='utf-8') as fp:
-            fp.write('-o\n{}\n'.format(self.outfile.replace('\\', '/')))
-            fp.write(sbr)
-            fp.write('{}\n'.format(self.aac_files[0].replace('\\', '/')))
-            for f in self.aac_files[1:]:
-                fp.write(sbr)
-                fp.write('+{}\n'.format(f.replace('\\', '/')))
-        cmd = [self.exe['mkvmerge'], '@{}'.format(opts)]
-        subprocess.check_call(cmd, stdout=subprocess.DEVNULL,
-                              stderr=subprocess.DEVNULL)
+    def _check_toolchain(self):
+        if not self.caps.found('ffmpeg'):
+            raise ValueError('ffmpeg not found ({})'.format(
+                self.exe['ffmpeg']
+            ))
+        encoders = [AUDIO_CODECS[self.codec][0]]
+        if self.duration is not None and len(self.audio_files) > 1:
+            encoders.append('flac')
+        for encoder in encoders:
+            if encoder not in self.caps.encoders:
+                raise ValueError('ffmpeg has no encoder {}'.format(encoder))
+        for name, needed in (('acrossfade', self.crossfade),
+                             ('loudnorm', self.loudnorm)):
+            if needed and name not in self.caps.filters:
+                raise ValueError('ffmpeg has no filter {}'.format(name))
+
+    def _length(self):
+        # length of the joined tracks in seconds
+        lengths = [_get_duration(f, self.exe['ffmpeg'])
+                   for f in self.audio_files]
+        length = sum(lengths) - self.crossfade * (len(lengths) - 1)
+        if length <= 0:
+            raise ValueError('Audio files are too short')
+        return length
+
+    def create_soundtrack(self):
+        tracks = self.audio_files
+        loop = self.duration is not None and self._length() < self.duration
+        if loop and len(tracks) > 1:
+            joined = os.path.join(self.tmp, 'joined.flac')
+            cmd, graph, last = self._join(tracks)
+            cmd.extend(['-filter_complex', ';'.join(graph), '-map',
+                        '[{}]'.format(last), '-c:a', 'flac'])
+            self._run(cmd, output=joined, stderr=subprocess.DEVNULL)
+            tracks = [joined]
+        cmd, graph, last = self._join(tracks, loop)
+        if self.loudnorm:
+            graph.append('[{}]loudnorm,aresample=48000[norm]'.format(last))
+            last = 'norm'
+        encoder, bitrate = AUDIO_CODECS[self.codec]
+        cmd.extend(['-filter_complex', ';'.join(graph), '-map',
+                    '[{}]'.format(last), '-c:a', encoder, '-b:a', bitrate])
+        if self.duration is not None:
+            cmd.extend(['-t', str(self.duration)])
+        self.outfile = os.path.join(self.tmp, 'soundtrack.mka')
+        self._run(cmd, output=self.outfile, stderr=subprocess.DEVNULL)
+
+    def _join(self, tracks, loop=False):
+        # ffmpeg command with the inputs and the filters joining them,
+        # `loop` repeats a single track endlessly
+        cmd = [self.exe['ffmpeg'], '-y']
+        if loop:
+            cmd.extend(['-stream_loop', '-1'])
+        graph = []
+        for n, f in enumerate(tracks):
+            cmd.extend(['-i', f])
+            graph.append('[{}:a]aresample=48000,aformat=sample_fmts=fltp:'
+                         'channel_layouts=stereo[a{}]'.format(n, n))
+        if len(tracks) == 1:
+            last = 'a0'
+        elif self.crossfade:
+            last = 'a0'
+            for n in range(1, len(tracks)):
+                graph.append('[{}][a{}]acrossfade=d={}[x{}]'.format(
+                    last, n, self.crossfade, n
+                ))
+                last = 'x{}'.format(n)
+        else:
+            graph.append('{}concat=n={}:v=0:a=1[joined]'.format(
+                ''.join('[a{}]'.format(n) for n in range(len(tracks))),
+                len(tracks)
+            ))
+            last = 'joined'
+        return cmd, graph, last
 
 
 class Muxer(Base):
+    """Write the final MKV file in a single MKVMerge run from the options
+       of the `VideoBuilder` (segments, tags, chapters) and the soundtrack.
+       The file is written next to `outfile` and renamed when complete.
+    """
 
-    def __init__(self, video_file, audio_file, outfile, workdir=None,
-                 executables=None):
-        Base.__init__(self, workdir, executables, outfile)
-        self.video_file = video_file
+    def __init__(self, video_options, audio_file, outfile, workdir=None,
+                 executables=None, resources=None):
+        Base.__init__(self, workdir, executables, outfile, resources)
+        self._make_tmp()
+        self.video_options = video_options
         self.audio_file = audio_file
-        self._counter = 1
 
     def mux(self):
-        if not os.path.isfile(self.audio_file):
-            shutil.copy(self.video_file, self.outfile)
-            return
-        vid_dur = _get_duration(self.video_file, self.exe['ffmpeg'])
-        aud_dur = _get_duration(self.audio_file, self.exe['ffmpeg'])
-        while True:
-            if aud_dur < vid_dur:
-                self._double_audio()
-                aud_dur = _get_duration(self.audio_file, self.exe['ffmpeg'])
-            else:
-                break
-        out = os.path.join(self.tmp, 'audio-cut-%02d.mkv')
-        cmd = [self.exe['mkvmerge'], '-o', out, '--split',
-               'timecodes:{}'.format(get_timecode(vid_dur)), self.audio_file]
-        subprocess.check_call(cmd, stdout=subprocess.DEVNULL,
-                              stderr=subprocess.DEVNULL)
-        self.audio_file = os.path.join(self.tmp, 'audio-cut-01.mkv')
-        cmd = [self.exe['mkvmerge'], '-o', self.outfile, self.video_file,
-               self.audio_file]
-        subprocess.check_call(cmd, stdout=subprocess.DEVNULL,
-                              stderr=subprocess.DEVNULL)
-
-    def _double_audio(self):
-        out = os.path.join(self.tmp, 'audio-{:>02d}.mkv'.format(self._counter))
-        self._counter += 1
-        cmd = [self.exe['mkvmerge'], '-o', out, self.audio_file, '+',
-               self.audio_file]
-        subprocess.check_call(cmd, stdout=subprocess.DEVNULL,
-                              stderr=subprocess.DEVNULL)
-        self.audio_file = out
-
-
-def _worker(builder, queue):
+        part = '{}.part'.format(self.outfile)
+        cmd = [self.exe['mkvmerge'], '-o', part,
+               '@{}'.format(self.video_options)]
+        if self.audio_file is not None:
+            cmd.append(self.audio_file)
+        try:
+            self._run(cmd, stdout=subprocess.DEVNULL,
+                      stderr=subprocess.DEVNULL)
+            os.replace(part, self.outfile)
+        except BaseException:
+            # also on KeyboardInterrupt, nothing is left next to outfile
+            if os.path.isfile(part):
+                os.remove(part)
+            raise
+
+
+BACKENDS = {
+    'imagemagick': VideoBuilder,
+    'pillow': PillowVideoBuilder,
+}
+
+
+class Progress:
+    """Collect the events sent by the builders and estimate the remaining
+       time of the whole show.
+
+    Image tasks (copy, resize, morph, ...) run before the movies are
+    encoded, so both are measured separately. Until the first frames are
+    encoded, one frame is expected to take as long as a task divided by
+    the frames per second of the profile.
+    """
+
+    def __init__(self, fps, callback=None):
+        self.fps = fps
+        self.callback = callback
+        self.start = time.time()
+        self.frames_done = 0
+        self.frames_total = 0
+        self.tasks_done = 0
+        self.tasks_total = 0
+        self.stage = None
+        self._task_time = 0.0
+        self._frame_start = None
+
+    def update(self, event):
+        now = time.time()
+        kind = event['kind']
+        if kind == 'totals':
+            self.frames_total += event['frames']
+            self.tasks_total += event['tasks']
+        elif kind == 'task':
+            self.tasks_done += 1
+            self._task_time = now - self.start
+        elif kind == 'frames':
+            if self._frame_start is None:
+                self._frame_start = now
+            self.frames_done += event['frames']
+        elif kind == 'stage':
+            self.stage = event['stage']
+        state = self.state(now)
+        state['event'] = event
+        if self.callback is not None:
+            self.callback(state)
+        return state
+
+    def eta(self, now=None):
+        now = now or time.time()
+        if not self.tasks_done and not self.frames_done:
+            return None
+        per_task = self._task_time / self.tasks_done if self.tasks_done \
+            else None
+        if self.frames_done:
+            per_frame = (now - self._frame_start) / self.frames_done
+        else:
+            per_frame = per_task / self.fps
+        if per_task is None:
+            per_task = per_frame * self.fps
+        return (per_task * (self.tasks_total - self.tasks_done) +
+                per_frame * (self.frames_total - self.frames_done))
+
+    def state(self, now=None):
+        now = now or time.time()
+        return {
+            'stage': self.stage,
+            'frames_done': self.frames_done,
+            'frames_total': self.frames_total,
+            'tasks_done': self.tasks_done,
+            'tasks_total': self.tasks_total,
+            'elapsed': now - self.start,
+            'eta': self.eta(now),
+        }
+
+
+def json_progress(fp):
+    """Create a progress callback writing one JSON object per line to the
+       file object `fp`."""
+    def _callback(state):
+        fp.write(json.dumps(state))
+        fp.write('\n')
+        fp.flush()
+    return _callback
+
+
+def _worker(builder, queue, status_stream='stdout'):
+    out = getattr(sys, status_stream)
     for desc, t in builder:
-        print(desc, '| Duration: {:.1f}s'.format(t))
+        print(desc, '| Duration: {:.1f}s'.format(t), file=out)
     queue.put(builder.outfile)
 
 
+def _drain(events, progress):
+    while True:
+        try:
+            event = events.get_nowait()
+        except queue.Empty:
+            return
+        progress.update(event)
+
+
 def slideshow(pictures, audio_files=None, remove_tempfiles=True,
-              output='slideshow.mkv', **kwargs):
+              output='slideshow.mkv', progress=None, crossfade=0,
+              loudnorm=False, audio_codec='aac', backend='imagemagick',
+              status_stream='stdout', **kwargs):
+    # status lines go to sys.stdout or sys.stderr (`status_stream`), the
+    # name is sent to the build processes
+    status = getattr(sys, status_stream)
     if 'profile' in kwargs and not isinstance(kwargs['profile'], Profile):
         kwargs['profile'] = PROFILES[kwargs['profile'].lower()]
     if not output.lower().endswith('.mkv'):
@@ -552,42 +1641,242 @@ def slideshow(pictures, audio_files=None, remove_tempfiles=True,
     kwargs['remove_tempfiles'] = remove_tempfiles
     workdir = kwargs.get('workdir', None)
     executables = kwargs.get('executables', None)
+    resources = kwargs.get('profile', PROFILES['1080p']).resources
     start = time.time()
-    vbuilder = VideoBuilder(pictures, **kwargs)
+    vbuilder = BACKENDS[backend](pictures, **kwargs)
+    if vbuilder.duplicates:
+        print('Left out {} near-duplicate pictures'.format(
+            len(vbuilder.duplicates)
+        ), file=status)
+    if vbuilder.stream is not None:
+        print('Streaming to', vbuilder.stream.filename, file=status)
+    tracker = Progress(vbuilder.profile.fps, progress)
+    events = mp.Queue()
+    vbuilder.events = events
     vqueue = mp.Queue(1)
-    vprocess = mp.Process(target=_worker, args=(vbuilder, vqueue))
+    vprocess = mp.Process(target=_worker,
+                          args=(vbuilder, vqueue, status_stream))
     vprocess.start()
     if audio_files:
-        abuilder = AudioBuilder(audio_files, workdir, executables)
+        abuilder = AudioBuilder(audio_files, workdir, executables, resources,
+                                vbuilder.duration, crossfade, loudnorm,
+                                audio_codec)
+        abuilder.events = events
         aqueue = mp.Queue(1)
-        aprocess = mp.Process(target=_worker, args=(abuilder, aqueue))
+        aprocess = mp.Process(target=_worker,
+                              args=(abuilder, aqueue, status_stream))
         aprocess.start()
     while True:
         if not vprocess.is_alive():
-            if audio_files and not aprocess.is_alive():
+            if not audio_files or not aprocess.is_alive():
                 break
+        _drain(events, tracker)
         print(next(_P), end='\r', file=sys.stderr, flush=True)
         time.sleep(0.2)
+    _drain(events, tracker)
     video = vqueue.get()
-    if audio_files:
-        audio = aqueue.get()
-        muxer = Muxer(video, audio, output, workdir, executables)
-        muxer.mux()
-    else:
-        shutil.copy(video, output)
+    audio = aqueue.get() if audio_files else None
+    muxer = Muxer(video, audio, output, workdir, executables, resources)
+    muxer.mux()
     if remove_tempfiles:
-        print('Removing temporary files')
+        print('Removing temporary files', file=status)
         vbuilder.cleanup()
+        muxer.cleanup()
         if audio_files:
             abuilder.cleanup()
-            muxer.cleanup()
     duration = time.time() - start
     print('Duration of the whole process: {}'.format(
         get_timecode(duration, only_int=True)
-    ))
+    ), file=status)
     return output
 
 
+def plan(pictures, audio_files=None, remove_tempfiles=True,
+         output='slideshow.mkv', progress=None, crossfade=0, loudnorm=False,
+         audio_codec='aac', backend='imagemagick', status_stream='stdout',
+         **kwargs):
+    """Plan a slideshow without building it. Takes the same arguments as
+       `slideshow`. The inputs are resolved (and de-duplicated if wanted),
+       picture sizes and audio durations are read and the costs of every
+       stage are estimated from a throughput model measured once on this
+       machine (see `calibrate`).
+
+    :returns: The plan with tasks and estimates (sizes in bytes, times in
+              seconds)
+    :rtype: dict
+    """
+    if 'profile' in kwargs and not isinstance(kwargs['profile'], Profile):
+        kwargs['profile'] = PROFILES[kwargs['profile'].lower()]
+    kwargs['remove_tempfiles'] = remove_tempfiles
+    stream = kwargs.pop('stream', None)
+    vbuilder = BACKENDS[backend](pictures, **kwargs)
+    try:
+        model = calibrate(vbuilder)
+        sizes = vbuilder.probe_sizes()
+        tasks = vbuilder.plan_tasks(sizes)
+    finally:
+        vbuilder.cleanup()
+    num = len(vbuilder.source_pictures)
+    if stream:
+        tasks.insert(-1, dict(stage='Published stream segments',
+                              tool='ffmpeg', count=2 * num + 3, frames=0))
+    audio = _get_audio(audio_files or [])
+    ffmpeg = vbuilder.exe['ffmpeg']
+    audio_duration = sum(_get_duration(f, ffmpeg) for f in audio)
+    fps = vbuilder.profile.fps
+    frames = vbuilder.duration * fps
+    transition_frames = (num + 1) * fps * vbuilder.transition_duration
+    still_frames = frames - transition_frames
+    # pictures with Ken Burns effect are moving content as well
+    still = 'motion' if vbuilder.ken_burns else 'still'
+    video_bytes = (still_frames * model['{}_frame_bytes'.format(still)] +
+                   transition_frames * model['motion_frame_bytes'])
+    audio_bytes = 0
+    if audio:
+        audio_bytes = vbuilder.duration * int(
+            AUDIO_CODECS[audio_codec][1].rstrip('k')
+        ) * 1000 / 8
+    image_time = sum(t['mpixels'] * model[t.get('rate', 'mpixel_seconds')]
+                     for t in tasks if 'mpixels' in t)
+    # picture and transition movies are encoded in parallel
+    encode_time = max(
+        (vbuilder.frames_total - transition_frames) *
+        model['{}_frame_seconds'.format(still)],
+        transition_frames * model['motion_frame_seconds']
+    )
+    output_bytes = video_bytes + audio_bytes
+    # the output is assembled from the movies, no whole-show copy is made
+    if remove_tempfiles:
+        # pictures and morph frames are removed once they are encoded
+        workdir_bytes = max(vbuilder.plan_workdir(sizes), video_bytes)
+    else:
+        workdir_bytes = vbuilder.plan_workdir(sizes) + video_bytes
+    workdir_bytes += audio_bytes
+    return {
+        'pictures': vbuilder.source_pictures,
+        'duplicates': vbuilder.duplicates,
+        'sizes': sizes,
+        'audio_files': audio,
+        'audio_duration': audio_duration,
+        'duration': vbuilder.duration,
+        'frames': frames,
+        'encoded_frames': vbuilder.frames_total,
+        'tasks': tasks,
+        'workdir_peak_bytes': int(workdir_bytes),
+        'output_bytes': int(output_bytes),
+        'stream_bytes': int(video_bytes) if stream else 0,
+        'wall_time': image_time + encode_time,
+        'model': model,
+    }
+
+
+def calibrate(builder, refresh=False):
+    """Measure the speed of the image processing and the encoder for the
+       profile and backend of `builder`. The results are cached per
+       toolchain, so this runs only once on every machine.
+
+    :returns: Seconds per megapixel for copying and for morphing pictures,
+              seconds and bytes per frame for still and moving content
+    :rtype: dict
+    """
+    width, height = builder.profile.size
+    fps = builder.profile.fps
+    key = json.dumps([CALIBRATION_REVISION, builder.caps.data['paths'],
+                      builder.caps.ffmpeg_version,
+                      builder.caps.magick_version, builder.__class__.__name__,
+                      builder.ext, width, height, fps])
+    cache = os.path.join(_cache_dir(), 'calibration.json')
+    results = {}
+    if os.path.isfile(cache):
+        with open(cache, encoding='utf-8') as fp:
+            results = json.load(fp)
+    if key in results and not refresh:
+        return results[key]
+    frames = 2 * fps
+    model = {}
+    for kind, vf in (('still', ['-vf', 'trim=end_frame=1,loop=-1:1']),
+                     ('motion', [])):
+        out = os.path.join(builder.tmp, 'calibrate-{}.mp4'.format(kind))
+        cmd = [builder.exe['ffmpeg'], '-y', '-f', 'lavfi', '-i',
+               'testsrc2=size={}x{}:rate={}'.format(width, height, fps)]
+        cmd.extend(vf + ['-frames:v', str(frames)] + _x264(fps) +
+                   ['-pix_fmt', 'yuv420p'])
+        start = time.time()
+        builder._run(cmd, output=out, stderr=subprocess.DEVNULL)
+        model['{}_frame_seconds'.format(kind)] = (time.time() - start) / \
+            frames
+        model['{}_frame_bytes'.format(kind)] = os.path.getsize(out) / frames
+    model['mpixel_seconds'] = _calibrate_images(builder)
+    model['morph_mpixel_seconds'] = _calibrate_morph(builder)
+    results[key] = model
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(cache, os.getpid())
+    with open(tmp, 'w', encoding='utf-8') as fp:
+        json.dump(results, fp, indent=2)
+    os.replace(tmp, cache)
+    return model
+
+
+def _calibrate_images(builder):
+    # Copy and scale a photo sized picture (4 times the profile) once, the
+    # way copy_source_files does for pictures with the 'scale' route
+    width, height = builder.profile.size
+    src = os.path.join(builder.tmp, 'calibrate-src.jpg')
+    dest = os.path.join(builder.tmp, 'calibrate.{}'.format(builder.ext))
+    if isinstance(builder, PillowVideoBuilder):
+        Image.effect_noise((2 * width, 2 * height), 64).convert('RGB').save(
+            src, 'JPEG'
+        )
+        start = time.time()
+        with Image.open(src) as img:
+            img.draft('RGB', builder.profile.size)
+            img = ImageOps.pad(ImageOps.exif_transpose(img),
+                               builder.profile.size, Image.LANCZOS)
+        builder._save(img, dest)
+        mpixels = width * height / 1e6
+    else:
+        cmd = [builder.exe['convert'], '-size',
+               '{}x{}'.format(2 * width, 2 * height), 'plasma:', src]
+        builder._run(cmd)
+        size = '{}x{}'.format(width, height)
+        draft = _draft_size((2 * width, 2 * height), 1, builder.profile.size)
+        start = time.time()
+        builder._run([builder.exe['convert'], '-define',
+                      'jpeg:size={}x{}'.format(*draft), src, '-auto-orient',
+                      '-resize', size, '-background', 'black', '-gravity',
+                      'center', '-extent', size, dest])
+        # the planned copy stage counts the pixels of the sources
+        mpixels = 4 * width * height / 1e6
+    return (time.time() - start) / mpixels
+
+
+def _calibrate_morph(builder):
+    # Morph two profile sized pictures for one second the way
+    # create_anim_pictures (or create_transition_movies with Pillow) does
+    width, height = builder.profile.size
+    fps = builder.profile.fps
+    if isinstance(builder, PillowVideoBuilder):
+        imgs = [Image.effect_noise((width, height), 64).convert('RGB')
+                for _ in range(2)]
+        start = time.time()
+        for _ in _blend_frames(imgs[0], imgs[1], fps):
+            pass
+    else:
+        pics = [os.path.join(builder.tmp, 'calibrate-morph{}.{}'.format(
+            n, builder.ext
+        )) for n in range(2)]
+        for pic in pics:
+            builder._run([builder.exe['convert'], '-size',
+                          '{}x{}'.format(width, height), 'plasma:', pic])
+        out = os.path.join(builder.tmp, 'calibrate-morph',
+                           '%03d.{}'.format(builder.ext))
+        os.mkdir(os.path.dirname(out))
+        start = time.time()
+        builder._run([builder.exe['convert']] + pics +
+                     ['-morph', str(max(fps - 2, 1)), out])
+    return (time.time() - start) / (fps * width * height / 1e6)
+
+
 def recurse(folder):
     folder = os.path.abspath(folder)
     for root, _, files in os.walk(folder):
@@ -629,10 +1918,6 @@ def get_timecode(seconds, only_int=False):
     return format_str.format(hour, minute, second)
 
 
-def _progress(num, count=None):
-    pass
-
-
 def _get_seconds(s):
     h, m, s = s.split(':')
     return int(h) * 3600 + int(m) * 60 + float(s)
@@ -668,6 +1953,435 @@ def _pairwise(pictures):
     return zip(a, b)
 
 
+def probe_toolchain(executables=None, refresh=False):
+    """Find out versions and features of the external programs. The result
+       is cached on disk for each toolchain, identified by the paths and
+       modification times of the programs and of the font folders, so the
+       programs are only asked again after an update.
+
+    :parameters:
+        executables : dict
+            Mapping of program names to executables (see EXECUTABLES).
+        refresh : bool
+            Ignore a cached result.
+
+    :returns: The capabilities of the toolchain
+    :rtype: Capabilities
+    """
+    exe = EXECUTABLES.copy()
+    if executables:
+        exe.update(executables)
+    paths = {}
+    stats = []
+    for prog in sorted(exe):
+        path = shutil.which(exe[prog])
+        paths[prog] = path
+        if path is not None:
+            st = os.stat(path)
+            stats.append([prog, os.path.realpath(path), st.st_mtime,
+                          st.st_size])
+    key = json.dumps([__version__, stats, _font_state()]).encode('utf-8')
+    cache = os.path.join(
+        _cache_dir(), 'toolchain-{}.json'.format(hashlib.sha1(key).hexdigest())
+    )
+    if not refresh and os.path.isfile(cache):
+        with open(cache, encoding='utf-8') as fp:
+            return Capabilities(json.load(fp))
+    data = {
+        'paths': paths,
+        'ffmpeg': _probe_ffmpeg(paths['ffmpeg']),
+        'magick': _probe_magick(paths['convert']),
+        'mkvmerge': _probe_mkvmerge(paths['mkvmerge']),
+    }
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(cache, os.getpid())
+    with open(tmp, 'w', encoding='utf-8') as fp:
+        json.dump(data, fp, indent=2)
+    os.replace(tmp, cache)
+    return Capabilities(data)
+
+
+def _font_state():
+    # Modification times of the folders with fonts and font configuration
+    # (fontconfig caches, ImageMagick type files), they change when fonts
+    # are installed
+    home = os.path.expanduser('~')
+    if os.name == 'nt':
+        windir = os.environ.get('SystemRoot', r'C:\Windows')
+        folders = [os.path.join(windir, 'Fonts'),
+                   os.path.join(os.environ.get('LOCALAPPDATA', home),
+                                'Microsoft', 'Windows', 'Fonts')]
+    else:
+        folders = ['/etc/fonts', '/usr/share/fonts', '/usr/local/share/fonts',
+                   '/var/cache/fontconfig', '/Library/Fonts',
+                   os.path.join(home, '.fonts'),
+                   os.path.join(home, '.local', 'share', 'fonts'),
+                   os.path.join(home, '.cache', 'fontconfig'),
+                   os.path.join(home, 'Library', 'Fonts')]
+        for version in (6, 7):
+            folders.extend([
+                '/etc/ImageMagick-{}'.format(version),
+                '/usr/local/etc/ImageMagick-{}'.format(version),
+            ])
+    folders.append(os.path.join(home, '.config', 'ImageMagick'))
+    for name in ('MAGICK_CONFIGURE_PATH', 'MAGICK_FONT_PATH'):
+        folders.extend(os.environ.get(name, '').split(os.pathsep))
+    state = []
+    for folder in folders:
+        if folder and os.path.isdir(folder):
+            state.append([folder, os.stat(folder).st_mtime])
+    return state
+
+
+def _cache_dir():
+    if os.name == 'nt':
+        root = os.environ.get('LOCALAPPDATA', gettempdir())
+    else:
+        root = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(root, 'ffmagick')
+
+
+def _probe_output(cmd):
+    try:
+        p = subprocess.run(cmd, stdout=subprocess.PIPE,
+                           stderr=subprocess.DEVNULL)
+    except OSError:
+        return ''
+    return p.stdout.decode('utf-8', 'replace')
+
+
+def _probe_ffmpeg(ffmpeg):
+    info = dict(version=None, filters=[], encoders=[], decoders=[])
+    if ffmpeg is None:
+        return info
+    out = _probe_output([ffmpeg, '-hide_banner', '-version'])
+    match = re.match(r'ffmpeg version (\S+)', out)
+    if match:
+        info['version'] = match.group(1)
+    out = _probe_output([ffmpeg, '-hide_banner', '-filters'])
+    for line in out.splitlines():
+        parts = line.split()
+        if len(parts) > 2 and '->' in parts[2]:
+            info['filters'].append(parts[1])
+    for kind in ('encoders', 'decoders'):
+        out = _probe_output([ffmpeg, '-hide_banner', '-{}'.format(kind)])
+        # the list follows a legend ending with ' ------'
+        items = out.partition(' ------')[2]
+        for line in items.splitlines():
+            parts = line.split()
+            if len(parts) > 1:
+                info[kind].append(parts[1])
+    return info
+
+
+def _probe_magick(convert):
+    info = dict(version=None, formats=[], fonts=[], font_files={},
+                resources={})
+    if convert is None:
+        return info
+    out = _probe_output([convert, '-version'])
+    match = re.search(r'ImageMagick (\S+)', out)
+    if match:
+        info['version'] = match.group(1)
+    out = _probe_output([convert, '-list', 'format'])
+    for line in out.splitlines():
+        parts = line.split()
+        if len(parts) > 2 and re.match(r'[r-][w-][+-]$', parts[2]):
+            if parts[2][1] == 'w':
+                info['formats'].append(parts[0].rstrip('*'))
+    out = _probe_output([convert, '-list', 'font'])
+    font = None
+    for line in out.splitlines():
+        if 'Font:' in line:
+            font = line.split()[1].strip()
+            info['fonts'].append(font)
+        elif 'glyphs:' in line and font is not None:
+            info['font_files'][font] = line.split(':', 1)[1].strip()
+    out = _probe_output([convert, '-list', 'resource'])
+    for line in out.splitlines():
+        name, sep, value = line.partition(':')
+        if sep and value.strip() and name.strip()[:1].isupper():
+            info['resources'][name.strip().lower()] = value.strip()
+    return info
+
+
+def _probe_mkvmerge(mkvmerge):
+    info = dict(version=None)
+    if mkvmerge is None:
+        return info
+    out = _probe_output([mkvmerge, '--version'])
+    match = re.match(r'mkvmerge v(\S+)', out)
+    if match:
+        info['version'] = match.group(1)
+    return info
+
+
+def _x264(fps):
+    # encoder options for the movies of a show
+    return ['-c:v', 'libx264', '-g', str(KEYFRAME_INTERVAL * fps)]
+
+
+def _ken_burns_filter(size, profile, frames):
+    """Build a zoompan filter for a letterboxed picture. The motion starts
+       and ends with the whole picture, so the morph transitions before and
+       after fit seamlessly. In between it zooms into the picture content
+       (hiding the borders as far as possible) and pans along its longer
+       side. The picture is scaled up before, which keeps the motion
+       smooth.
+
+    :parameters:
+        size : tuple
+            Width and height of the picture before letterboxing.
+        profile : Profile
+            Output profile.
+        frames : int
+            Number of frames to create.
+
+    :returns: Filter description for ffmpeg's -vf option
+    :rtype: str
+    """
+    width, height = profile.size
+    scale = min(width / size[0], height / size[1])
+    content_w, content_h = size[0] * scale, size[1] * scale
+    fit = max(width / content_w, height / content_h)
+    peak = min(fit, KEN_BURNS_MAX_FIT) * KEN_BURNS_ZOOM
+    pan_x = max(0, content_w - width / peak) / 2
+    pan_y = max(0, content_h - height / peak) / 2
+    factor = max(1, min(KEN_BURNS_OVERSAMPLE, KEN_BURNS_MAX_WIDTH // width))
+    last = max(frames - 1, 1)
+    zoom = '1+{:.4f}*sin(PI*on/{})'.format(peak - 1, last)
+    x = 'max(0,min(iw-iw/zoom,{:.1f}+{:.1f}*(2*on/{}-1)-iw/zoom/2))'.format(
+        factor * width / 2, factor * pan_x, last
+    )
+    y = 'max(0,min(ih-ih/zoom,{:.1f}+{:.1f}*(2*on/{}-1)-ih/zoom/2))'.format(
+        factor * height / 2, factor * pan_y, last
+    )
+    return ("scale={}x{}:flags=lanczos,"
+            "zoompan=z='{}':x='{}':y='{}':d={}:s={}x{}:fps={}").format(
+        factor * width, factor * height, zoom, x, y, frames, width, height,
+        profile.fps
+    )
+
+
+def _dhash(thumbs):
+    """Difference hashes for a stack of 9x8 grayscale thumbnails.
+
+    :parameters:
+        thumbs : numpy.ndarray
+            Array of shape (n, 8, 9) with dtype uint8.
+
+    :returns: One 64 bit hash per thumbnail
+    :rtype: numpy.ndarray
+    """
+    bits = thumbs[:, :, 1:] > thumbs[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(thumbs), 64), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+def _popcount(values):
+    # number of set bits of every uint64 in the 1-d array `values`
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    table = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None],
+                          axis=1).sum(axis=1)
+    octets = np.ascontiguousarray(values).view(np.uint8)
+    return table[octets].reshape(len(values), 8).sum(axis=1)
+
+
+def _find_duplicates(hashes, threshold):
+    """Mark every hash which is at most `threshold` bits away from an
+       earlier one.
+
+    The hashes are cut into threshold + 1 bands. Two hashes within the
+    threshold agree in at least one band completely (pigeonhole), so only
+    hashes sharing a band value are compared. Grouping is done by sorting
+    each band, which keeps the search at O(n log n) for real photo
+    collections instead of comparing all pairs.
+
+    :returns: List of booleans, True for duplicates
+    :rtype: list
+    """
+    count = len(hashes)
+    parent = list(range(count))
+
+    def _root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def _union(i, j):
+        a, b = _root(i), _root(j)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+
+    # equal hashes are joined directly, only distinct ones are compared
+    unique, first, inverse = np.unique(hashes, return_index=True,
+                                       return_inverse=True)
+    for i, u in enumerate(inverse.ravel()):
+        _union(i, first[u])
+    bands = threshold + 1
+    width = 64 // bands
+    for band in range(bands):
+        shift = band * width
+        bits = width if band < bands - 1 else 64 - shift
+        mask = np.uint64((1 << bits) - 1)
+        keys = (unique >> np.uint64(shift)) & mask
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(
+            np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        )
+        ends = np.r_[starts[1:], len(unique)]
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            members = first[order[start:end]]
+            group = unique[order[start:end]]
+            # row by row, a whole distance matrix gets huge for many
+            # similar pictures
+            for i in range(len(group) - 1):
+                dist = _popcount(group[i + 1:] ^ group[i])
+                for j in np.flatnonzero(dist <= threshold):
+                    _union(members[i], members[i + 1 + j])
+    return [_root(i) != i for i in range(count)]
+
+
+def _draft_size(stored, orientation, size):
+    # Smallest size to request from a draft (reduced) decode of a picture
+    # stored with size `stored`, so it still fills `size` after the EXIF
+    # rotation
+    w, h = stored
+    rotated = orientation in (5, 6, 7, 8)
+    if rotated:
+        w, h = h, w
+    scale = min(size[0] / w, size[1] / h)
+    if scale >= 1:
+        return tuple(stored)
+    draft = (math.ceil(w * scale), math.ceil(h * scale))
+    return draft[::-1] if rotated else draft
+
+
+def read_image_info(filename):
+    """Read size, EXIF orientation and color space of a JPEG, PNG, TIFF or
+       BMP picture from its header, without decoding it.
+
+    :returns: The header data or None for unknown or broken files
+    :rtype: ImageInfo
+    """
+    try:
+        with open(filename, 'rb') as fp:
+            head = fp.read(32)
+            fp.seek(0)
+            if head[:2] == b'\xff\xd8':
+                return _jpeg_info(fp)
+            if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+                w, h, _, color = struct.unpack('>IIBB', head[16:26])
+                space = 'gray' if color in (0, 4) else 'rgb'
+                return ImageInfo('png', w, h, 1, space)
+            if head[:4] in (b'II*\x00', b'MM\x00*'):
+                return _tiff_info(_file_reader(fp), 'tiff')
+            if head[:2] == b'BM':
+                w, h = struct.unpack('<ii', head[18:26])
+                return ImageInfo('bmp', w, abs(h), 1, 'rgb')
+    except (OSError, struct.error, ValueError, IndexError):
+        pass
+    return None
+
+
+def _jpeg_info(fp):
+    orientation = 1
+    adobe = None
+    fp.read(2)
+    while True:
+        marker = fp.read(2)
+        while marker[1:2] == b'\xff':
+            marker = marker[1:] + fp.read(1)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        code = marker[1]
+        if code in (0xd8, 0x01) or 0xd0 <= code <= 0xd7:
+            continue
+        length = struct.unpack('>H', fp.read(2))[0]
+        data = fp.read(length - 2)
+        if code == 0xe1 and data[:6] == b'Exif\x00\x00':
+            info = _tiff_info(_bytes_reader(data[6:]), 'exif')
+            if info is not None:
+                orientation = info.orientation
+        elif code == 0xee and data[:5] == b'Adobe' and len(data) > 11:
+            adobe = data[11]
+        elif 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            h, w, components = struct.unpack('>HHB', data[1:6])
+            if components == 1:
+                space = 'gray'
+            elif components == 3:
+                space = 'rgb' if adobe == 0 else 'ycbcr'
+            else:
+                space = 'ycck' if adobe == 2 else 'cmyk'
+            return ImageInfo('jpeg', w, h, orientation, space)
+        elif code == 0xda:
+            return None
+
+
+def _file_reader(fp):
+    def _read(offset, size):
+        fp.seek(offset)
+        return fp.read(size)
+    return _read
+
+
+def _bytes_reader(data):
+    def _read(offset, size):
+        return data[offset:offset + size]
+    return _read
+
+
+def _tiff_info(read, fmt):
+    # Only the first IFD is read, `read(offset, size)` returns the bytes
+    head = read(0, 8)
+    order = '<' if head[:2] == b'II' else '>'
+    offset = struct.unpack(order + 'I', head[4:8])[0]
+    count = struct.unpack(order + 'H', read(offset, 2))[0]
+    entries = read(offset + 2, 12 * count)
+    tags = {}
+    for n in range(count):
+        entry = entries[12 * n:12 * n + 12]
+        tag, kind = struct.unpack(order + 'HH', entry[:4])
+        if kind == 3:
+            tags[tag] = struct.unpack(order + 'H', entry[8:10])[0]
+        elif kind == 4:
+            tags[tag] = struct.unpack(order + 'I', entry[8:12])[0]
+    spaces = {0: 'gray', 1: 'gray', 2: 'rgb', 3: 'rgb', 5: 'cmyk',
+              6: 'ycbcr'}
+    return ImageInfo(fmt, tags.get(256, 0), tags.get(257, 0),
+                     tags.get(274, 1), spaces.get(tags.get(262), 'other'))
+
+
+def _load_rgb(filename):
+    with Image.open(filename) as img:
+        return img.convert('RGB')
+
+
+def _blend_frames(img1, img2, frames):
+    last = max(frames - 1, 1)
+    for n in range(frames):
+        yield Image.blend(img1, img2, n / last).tobytes()
+
+
+def _feed(stream, chunks):
+    try:
+        for chunk in chunks:
+            stream.write(chunk)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            stream.close()
+        except BrokenPipeError:
+            pass
+
+
 def _get_sample_numbers(max_num):
     nums = set()
     while True:
@@ -721,20 +2435,9 @@ def paste_buildfile(args):
 
 
 def print_fonts(args):
-    p = subprocess.Popen(
-        [args.convert, '-list', 'font'], stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL
-    )
-    fonts = []
-    default_font_found = False
-    for line in p.stdout:
-        line = line.decode('utf-8').strip()
-        if 'Font:' in line:
-            font = line.split()[1].strip()
-            fonts.append(font)
-            if font == DEFAULT_FONT:
-                default_font_found = True
-    p.wait()
+    caps = probe_toolchain({'convert': args.convert}, args.refresh)
+    fonts = caps.fonts
+    default_font_found = DEFAULT_FONT in fonts
     print('')
     count = len(fonts) + 1
     for f in fonts:
@@ -747,19 +2450,18 @@ def print_fonts(args):
 
 
 def find_progs(args):
+    caps = probe_toolchain(refresh=args.refresh)
+    paths = caps.data['paths']
     print('')
-    print('Looking for ImageMagick')
+    print('Looking for ImageMagick', caps.magick_version or '')
     for prog in ('convert', 'montage', 'mogrify'):
-        p = shutil.which(prog)
-        print(' * {}: {}'.format(prog, p or 'not found'))
+        print(' * {}: {}'.format(prog, paths[prog] or 'not found'))
     print('')
-    print('Looking for ffmpeg')
-    p = shutil.which('ffmpeg')
-    print(' * ffmpeg: {}'.format(p or 'not found'))
+    print('Looking for ffmpeg', caps.ffmpeg_version or '')
+    print(' * ffmpeg: {}'.format(paths['ffmpeg'] or 'not found'))
     print('')
-    print('Looking for mkvtoolnix')
-    p = shutil.which('mkvmerge')
-    print(' * mkvmerge: {}'.format(p or 'not found'))
+    print('Looking for mkvtoolnix', caps.mkvmerge_version or '')
+    print(' * mkvmerge: {}'.format(paths['mkvmerge'] or 'not found'))
     print('')
     print('If one or more components are not found, install them or give '
           'the full path to the executables in your buildfile or on the '
@@ -808,7 +2510,7 @@ def _slideshow(args):
         if f.startswith('+'):
             audio_files.append(recurse_audio(f[1:]))
         elif f.startswith('@'):
-            audio_files.extent(_get_audio_from_file(f[1:]))
+            audio_files.extend(_get_audio_from_file(f[1:]))
         else:
             audio_files.append(f)
     _img = args.pop('images')
@@ -817,7 +2519,7 @@ def _slideshow(args):
         if f.startswith('+'):
             images.append(recurse(f[1:]))
         elif f.startswith('@'):
-            images.extent(_get_images_from_file(f[1:]))
+            images.extend(_get_images_from_file(f[1:]))
         else:
             images.append(f)
     for k in ('title', 'epilog'):
@@ -830,10 +2532,22 @@ def _slideshow(args):
         'ffmpeg': args.pop('ffmpeg'),
         'mkvmerge': args.pop('mkvmerge'),
     }
+    progress_json = args.pop('progress_json')
     del args['version']
     del args['func']
-    print(args)
-    # return slideshow(images, audio_files, **args)
+    if args.pop('plan'):
+        print(json.dumps(plan(images, audio_files, **args), indent=2))
+        return
+    if progress_json == '-':
+        # stdout only carries the JSON lines
+        return slideshow(images, audio_files,
+                         progress=json_progress(sys.stdout),
+                         status_stream='stderr', **args)
+    if progress_json:
+        with open(progress_json, 'w', encoding='utf-8') as fp:
+            return slideshow(images, audio_files, progress=json_progress(fp),
+                             **args)
+    return slideshow(images, audio_files, **args)
 
 
 def main():
@@ -856,11 +2570,17 @@ def main():
     )
     p_fonts.add_argument('--convert', default=_convert, help='Path to '
                          'convert(.exe) binary (default: %(default)s)')
+    p_fonts.add_argument('--refresh', action='store_true', default=False,
+                         help='Ask convert again instead of using the '
+                         'cached font list')
     p_fonts.set_defaults(func=print_fonts)
     p_progs = subparsers.add_parser(
         'list_progs', help='Try to find the needed external programs and '
         'list them', aliases=['lp']
     )
+    p_progs.add_argument('--refresh', action='store_true', default=False,
+                         help='Ask the programs again instead of using the '
+                         'cached versions')
     p_progs.set_defaults(func=find_progs)
     p_build = subparsers.add_parser(
         'buildfile', help='Create a default buildfile in the current working '
@@ -884,6 +2604,18 @@ def main():
                          'folders with a + to indicate that they should be '
                          'searched recursive. If prefixed with an @ values '
                          'are read from file (one per line)')
+    p_slide.add_argument('--crossfade', type=float, default=0,
+                         help='Seconds to crossfade between audio tracks '
+                         '(default: %(default)s)')
+    p_slide.add_argument('--loudnorm', action='store_true', default=False,
+                         help='Normalize the loudness of the soundtrack')
+    p_slide.add_argument('--audio-codec', choices=list(AUDIO_CODECS.keys()),
+                         default='aac', help='Codec for the soundtrack '
+                         '(default: %(default)s)')
+    p_slide.add_argument('-b', '--backend', choices=list(BACKENDS.keys()),
+                         default='imagemagick', help='Program for the image '
+                         'processing, pillow needs the Pillow package '
+                         '(default: %(default)s)')
     p_slide.add_argument('-p', '--profile', choices=list(PROFILES.keys()),
                          default='1080p', help='Output profile (default: '
                          '%(default)s)')
@@ -915,6 +2647,27 @@ def main():
                          default=True, help='Clean temporary files and '
                          'directories when all work is done (default: '
                          '%(default)s)')
+    p_slide.add_argument('-i', '--intermediate', default='jpg',
+                         choices=INTERMEDIATE_FORMATS, help='File format '
+                         'for pictures in the working directory, all but '
+                         'jpg are lossless (default: %(default)s)')
+    p_slide.add_argument('-k', '--ken-burns', action='store_true',
+                         default=False, help='Slowly zoom and pan over each '
+                         'picture (default: %(default)s)')
+    p_slide.add_argument('--progress-json', default=None, metavar='FILE',
+                         help='Write progress events as JSON lines to FILE '
+                         '(use - for stdout)')
+    p_slide.add_argument('-d', '--dedup', type=int, nargs='?', default=None,
+                         const=DEDUP_THRESHOLD, metavar='DISTANCE',
+                         help='Leave out near-duplicate pictures, optionally '
+                         'give the allowed difference (default: %(const)s), '
+                         'needs NumPy')
+    p_slide.add_argument('-s', '--stream', default=None, metavar='DIR',
+                         help='Write a HLS playlist to DIR, which can be '
+                         'played while the show is built')
+    p_slide.add_argument('--plan', action='store_true', default=False,
+                         help='Only print the tasks and cost estimates '
+                         '(time, disk space, output size) as JSON')
     p_slide.add_argument('-o', '--output', default='slideshow.mkv',
                          help='Name (and path) for the final output file '
                          '(default: %(default)s)')
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+from xml.etree import ElementTree
+
+from ffmagick import VideoBuilder
+
+
+def _chapters(tmp_path, **kwargs):
+    # only the attributes used for the chapters, no toolchain is needed
+    builder = SimpleNamespace(tmp=str(tmp_path), **kwargs)
+    builder._segment_durations = \
+        lambda: VideoBuilder._segment_durations(builder)
+    tree = ElementTree.parse(VideoBuilder._create_chapters_file(builder))
+    return [(atom.findtext('ChapterTimeStart'),
+             atom.findtext('ChapterDisplay/ChapterString'))
+            for atom in tree.iter('ChapterAtom')]
+
+
+def test_chapter_starts(tmp_path):
+    chapters = _chapters(tmp_path, image_duration=5, transition_duration=1,
+                         source_pictures=['/a/one.jpg', '/b/two.jpg'],
+                         title='Holiday')
+    assert chapters == [
+        ('00:00:00.0000', 'Holiday'),
+        ('00:00:08.0000', 'one.jpg'),
+        ('00:00:14.0000', 'two.jpg'),
+        ('00:00:20.0000', 'Epilog'),
+    ]
+
+
+def test_chapter_names(tmp_path):
+    chapters = _chapters(tmp_path, image_duration=3, transition_duration=2,
+                         source_pictures=['/a/<b>&c.jpg'], title='')
+    assert chapters == [
+        ('00:00:00.0000', 'Title'),
+        ('00:00:07.0000', '<b>&c.jpg'),
+        ('00:00:12.0000', 'Epilog'),
+    ]
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from ffmagick import _dhash, _find_duplicates, _popcount
+
+
+def _brute_force(hashes, threshold):
+    # compare all pairs, joined groups keep their first picture
+    count = len(hashes)
+    group = list(range(count))
+    for i in range(count):
+        for j in range(i + 1, count):
+            if bin(int(hashes[i]) ^ int(hashes[j])).count('1') <= threshold:
+                old, new = max(group[i], group[j]), min(group[i], group[j])
+                group = [new if g == old else g for g in group]
+    return [g != i for i, g in enumerate(group)]
+
+
+def _flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def _similar_hashes(seed):
+    # a few clusters of hashes some bits apart plus unrelated ones
+    rng = np.random.default_rng(seed)
+    hashes = []
+    for base in rng.integers(0, 2 ** 63, size=8, dtype=np.uint64):
+        for _ in range(5):
+            bits = rng.choice(64, size=rng.integers(0, 13), replace=False)
+            hashes.append(_flip(int(base), bits))
+    hashes.extend(int(h) for h in rng.integers(0, 2 ** 63, size=20,
+                                               dtype=np.uint64))
+    rng.shuffle(hashes)
+    return np.array(hashes, dtype=np.uint64)
+
+
+@pytest.mark.parametrize('threshold', [0, 4, 10])
+def test_find_duplicates_like_brute_force(threshold):
+    for seed in range(5):
+        hashes = _similar_hashes(seed)
+        assert _find_duplicates(hashes, threshold) == \
+            _brute_force(hashes, threshold)
+
+
+def test_exact_duplicates():
+    hashes = np.array([5, 7, 5, 5, 7, 2 ** 64 - 1], dtype=np.uint64)
+    assert _find_duplicates(hashes, 0) == [False, False, True, True, True,
+                                           False]
+
+
+def test_chain_is_joined():
+    a = 0
+    b = _flip(a, range(4))
+    c = _flip(b, range(4, 8))
+    hashes = np.array([a, b, c], dtype=np.uint64)
+    # a and c are 8 bits apart, but both are close to b
+    assert _find_duplicates(hashes, 4) == [False, True, True]
+    assert _find_duplicates(hashes[[0, 2]], 4) == [False, False]
+
+
+def test_popcount():
+    values = np.array([0, 1, 2 ** 64 - 1, 0x8000000000000001, 0xf0f0],
+                      dtype=np.uint64)
+    assert list(_popcount(values)) == [0, 1, 64, 2, 8]
+
+
+def test_popcount_without_bitwise_count(monkeypatch):
+    monkeypatch.delattr(np, 'bitwise_count', raising=False)
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 2 ** 63, size=50, dtype=np.uint64)
+    values[0] = 2 ** 64 - 1
+    assert list(_popcount(values)) == \
+        [bin(int(v)).count('1') for v in values]
+
+
+def test_dhash():
+    thumbs = np.zeros((3, 8, 9), dtype=np.uint8)
+    thumbs[1] = np.arange(9, dtype=np.uint8)
+    thumbs[2, 0, 1] = 1
+    hashes = _dhash(thumbs)
+    assert hashes.dtype == np.uint64
+    # rising rows set every bit, the first comparison is the highest bit
+    assert list(hashes) == [0, 2 ** 64 - 1, 2 ** 63]
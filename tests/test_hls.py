@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+
+from ffmagick import HLSPlaylist
+
+
+def _segments(playlist):
+    with open(playlist.filename, encoding='utf-8') as fp:
+        lines = fp.read().splitlines()
+    return [line for line in lines if line.startswith('segment-')], lines
+
+
+def test_empty_playlist(tmp_path):
+    playlist = HLSPlaylist(str(tmp_path / 'stream'), [3, 1, 5])
+    segments, lines = _segments(playlist)
+    assert segments == []
+    assert lines[0] == '#EXTM3U'
+    assert '#EXT-X-PLAYLIST-TYPE:EVENT' in lines
+    assert '#EXT-X-TARGETDURATION:5' in lines
+    assert '#EXT-X-ENDLIST' not in lines
+
+
+def test_add_out_of_order(tmp_path):
+    playlist = HLSPlaylist(str(tmp_path), [3, 1, 5, 1])
+    playlist.add(2)
+    playlist.add(4)
+    assert playlist.published == 0
+    assert _segments(playlist)[0] == []
+    playlist.add(1)
+    assert playlist.published == 2
+    segments, lines = _segments(playlist)
+    assert segments == ['segment-000001.ts', 'segment-000002.ts']
+    assert lines[-4:] == ['#EXTINF:3.000,', 'segment-000001.ts',
+                          '#EXTINF:1.000,', 'segment-000002.ts']
+    assert '#EXT-X-ENDLIST' not in lines
+    playlist.add(3)
+    assert playlist.published == 4
+    segments, lines = _segments(playlist)
+    assert len(segments) == 4
+    assert lines[-1] == '#EXT-X-ENDLIST'
+
+
+def test_segment_and_offset(tmp_path):
+    playlist = HLSPlaylist(str(tmp_path), [3, 1, 5, 1])
+    assert playlist.segment(12) == str(tmp_path / 'segment-000012.ts')
+    assert [playlist.offset(num) for num in range(1, 5)] == [0, 3, 4, 9]
+
+
+def test_pickle(tmp_path):
+    playlist = HLSPlaylist(str(tmp_path), [2, 2, 2])
+    playlist.add(1)
+    copy = pickle.loads(pickle.dumps(playlist))
+    assert copy._lock is not playlist._lock
+    assert copy.published == 1
+    copy.add(3)
+    copy.add(2)
+    segments, lines = _segments(copy)
+    assert len(segments) == 3
+    assert lines[-1] == '#EXT-X-ENDLIST'
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import struct
+
+from ffmagick import ImageInfo, read_image_info
+
+
+def _segment(code, data):
+    return bytes([0xff, code]) + struct.pack('>H', len(data) + 2) + data
+
+
+def _ifd(order, entries):
+    # TIFF header followed by the first IFD, `entries` are (tag, value)
+    # pairs stored as SHORT
+    data = (b'II*\x00' if order == '<' else b'MM\x00*')
+    data += struct.pack(order + 'IH', 8, len(entries))
+    for tag, value in entries:
+        data += struct.pack(order + 'HHIHH', tag, 3, 1, value, 0)
+    return data + struct.pack(order + 'I', 0)
+
+
+def _jpeg(width, height, components=3, exif=None, adobe=None):
+    data = b'\xff\xd8'
+    if exif is not None:
+        data += _segment(0xe1, b'Exif\x00\x00' + exif)
+    if adobe is not None:
+        data += _segment(0xee, adobe)
+    data += _segment(0xc0, struct.pack('>BHHB', 8, height, width,
+                                       components) + b'\x00' * 3 * components)
+    return data + _segment(0xda, b'\x00' * 10)
+
+
+def _write(tmp_path, name, data):
+    filename = tmp_path / name
+    filename.write_bytes(data)
+    return str(filename)
+
+
+def test_jpeg_without_exif(tmp_path):
+    info = read_image_info(_write(tmp_path, 'a.jpg', _jpeg(640, 480)))
+    assert info == ImageInfo('jpeg', 640, 480, 1, 'ycbcr')
+    assert info.size == (640, 480)
+
+
+def test_jpeg_with_exif_orientation(tmp_path):
+    exif = _ifd('>', [(274, 6)])
+    info = read_image_info(_write(tmp_path, 'a.jpg', _jpeg(640, 480,
+                                                           exif=exif)))
+    assert info.orientation == 6
+    assert info.size == (480, 640)
+
+
+def test_jpeg_gray_and_cmyk(tmp_path):
+    gray = read_image_info(_write(tmp_path, 'g.jpg', _jpeg(8, 8, 1)))
+    assert gray.colorspace == 'gray'
+    adobe = b'Adobe' + b'\x00' * 6 + b'\x02'
+    ycck = read_image_info(_write(tmp_path, 'y.jpg',
+                                  _jpeg(8, 8, 4, adobe=adobe)))
+    assert ycck.colorspace == 'ycck'
+    adobe = b'Adobe' + b'\x00' * 7
+    rgb = read_image_info(_write(tmp_path, 'r.jpg',
+                                 _jpeg(8, 8, 3, adobe=adobe)))
+    assert rgb.colorspace == 'rgb'
+
+
+def test_jpeg_short_adobe_segment(tmp_path):
+    info = read_image_info(_write(tmp_path, 'a.jpg',
+                                  _jpeg(16, 9, adobe=b'Adobe')))
+    assert info == ImageInfo('jpeg', 16, 9, 1, 'ycbcr')
+    assert read_image_info(_write(tmp_path, 'b.jpg',
+                                  b'\xff\xd8\xff\xee\x00\x07Adobe')) is None
+
+
+def test_jpeg_truncated(tmp_path):
+    data = _jpeg(640, 480)
+    assert read_image_info(_write(tmp_path, 'a.jpg', data[:8])) is None
+
+
+def test_png(tmp_path):
+    for color, space in ((0, 'gray'), (2, 'rgb'), (6, 'rgb')):
+        data = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR'
+        data += struct.pack('>IIBBBBB', 320, 200, 8, color, 0, 0, 0)
+        info = read_image_info(_write(tmp_path, 'a.png', data + b'\x00' * 4))
+        assert info == ImageInfo('png', 320, 200, 1, space)
+
+
+def test_tiff(tmp_path):
+    for order in '<>':
+        data = _ifd(order, [(256, 300), (257, 200), (262, 2), (274, 8)])
+        info = read_image_info(_write(tmp_path, 'a.tif', data))
+        assert info == ImageInfo('tiff', 300, 200, 8, 'rgb')
+        assert info.size == (200, 300)
+
+
+def test_bmp(tmp_path):
+    data = b'BM' + b'\x00' * 12 + struct.pack('<Iii', 40, 120, -80)
+    info = read_image_info(_write(tmp_path, 'a.bmp', data + b'\x00' * 8))
+    assert info == ImageInfo('bmp', 120, 80, 1, 'rgb')
+
+
+def test_unknown(tmp_path):
+    assert read_image_info(_write(tmp_path, 'a.txt', b'hello')) is None
+    assert read_image_info(str(tmp_path / 'missing.jpg')) is None